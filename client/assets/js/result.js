@@ -11,8 +11,10 @@ function displayResult(result) {
 
     // Update verdict section
     const verdictSection = document.getElementById('verdictSection');
-    
-    if (is_known) {
+    // A known sender can still carry a scam message body, so go by the verdict
+    const isLegitimate = verdict ? verdict === 'Legitimate Message' : is_known;
+
+    if (isLegitimate) {
         // LEGITIMATE MESSAGE
         verdictSection.innerHTML = `
             <div class="flex items-center justify-center w-20 h-20 bg-safe/10 rounded-full mb-4">
@@ -38,7 +40,7 @@ function displayResult(result) {
 
     // Update findings section based on message type
     const findingsSection = document.getElementById('findingsSection');
-    if (is_known) {
+    if (isLegitimate) {
         // Legitimate findings
         findingsSection.innerHTML = `
             <div class="flex items-start gap-4 p-4 bg-white rounded-xl shadow-sm">
@@ -68,8 +70,8 @@ function displayResult(result) {
                     <span class="material-symbols-outlined text-scam">link</span>
                 </div>
                 <div class="text-left">
-                    <p class="font-bold text-gray-800">Suspicious Sender</p>
-                    <p class="text-gray-600 text-sm">The sender ID is not recognized as an official HELB channel.</p>
+                    <p class="font-bold text-gray-800">${is_known ? 'Suspicious Content' : 'Suspicious Sender'}</p>
+                    <p class="text-gray-600 text-sm">${is_known ? 'The sender ID looks official, but the message reads like a scam.' : 'The sender ID is not recognized as an official HELB channel.'}</p>
                 </div>
             </div>
             <div class="flex items-start gap-4 p-4 bg-white rounded-xl shadow-sm">
@@ -86,7 +88,7 @@ function displayResult(result) {
 
     // Update next steps section
     const nextStepsSection = document.getElementById('nextStepsSection');
-    if (is_known) {
+    if (isLegitimate) {
         // Legitimate next steps
         nextStepsSection.innerHTML = `
             <h3 class="text-lg font-bold text-gray-800 mb-3">What to Do Next</h3>
@@ -1,10 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
-from werkzeug.utils import secure_filename
+import logging
 import os
 import json
-from helpers import extract_sender_id, verify_link_with_virustotal, extract_message_text, extract_urls_from_text
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from dotenv import load_dotenv
+
+# Load .env before the modules below read their settings
+load_dotenv()
+
+from metrics import ANALYSES, configure_logging, register_stats, render_metrics, timed
+configure_logging()
+
+import startup
+import shared_cache
+from ocr_strategy import strategy as ocr_strategy
+from jobs import JobQueue, QueueFull
+from sender_registry import registry as sender_registry
+from vt_cache import verdict_cache
+from image_cache import image_cache, fingerprint
+from batch import BATCH_MAX_PENDING, BatchTooLarge, collect_uploads, submit_ocr
+from ingest import UploadRejected, check_upload
+from retention import PERSIST_UPLOADS, upload_store
+from url_reputation import check_links, reputation as url_reputation
+from message_classifier import LURE_DESCRIPTIONS, MESSAGE_SCAM_THRESHOLD, score_message
+from helpers import ocr_screenshot, decode_image, extract_urls_from_text
+
+logger = logging.getLogger(__name__)
 
 
 app = Flask(__name__)
@@ -14,52 +36,183 @@ CORS(app)  # allow cross-origin requests (use more restrictive settings in produ
 BASE_DIR = os.path.dirname(__file__)
 app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'uploads')
 
-# Try to connect to MongoDB; if unavailable fall back to the bundled JSON
-collection = None
-sender_list = []
-try:
-    client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=2000)
-    # attempt a ping to ensure the server is reachable
-    client.admin.command('ping')
-    db = client['sms_scam_detection']
-    collection = db['sender_ids']
-except Exception:
-    # load bundled sender ids as a fallback
-    json_path = os.path.join(BASE_DIR, 'db', 'sender_ids.json')
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            sender_list = [entry.get('sender_id') for entry in json.load(f) if 'sender_id' in entry]
-    except Exception:
-        sender_list = []
+# Uploads are analysed in memory; set PERSIST_UPLOADS=1 to also keep a copy on disk
+# (debug/audit sink in hourly buckets, see retention.py for expiry and the size cap)
+app.config['PERSIST_UPLOADS'] = PERSIST_UPLOADS
+
+# Whole request body; single images are further limited by INGEST_MAX_BYTES (ingest.py),
+# this leaves room for zip archives on /analyze/batch
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', str(50 * 1024 * 1024)))
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# MongoDB and the OCR pool are set up per worker in the background (startup.py);
+# until Mongo answers the registry uses the bundled JSON. Under gunicorn this
+# already ran from post_fork; otherwise the first request starts it.
+@app.before_request
+def ensure_worker_initialised():
+    startup.init_worker()
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+@app.errorhandler(413)
+def request_too_large(e):
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'error': f'Upload too large (limit {limit_mb} MB)'}), 413
 
 def is_known_sender(sender_id):
     """Check if sender ID is known/legitimate with EXACT case-sensitive matching"""
-    if not sender_id:
-        return False
-    
     # EXACT matching only - case sensitive for security
     # This prevents scammers from using variations like "sure pay", "SUREPAY", etc.
-    
-    # If MongoDB is available use it
-    try:
-        if collection is not None:
-            # Exact match in MongoDB (case-sensitive)
-            result = collection.find_one({'sender_id': sender_id})
-            if result:
-                return True
-    except Exception as e:
-        print(f"[DEBUG] MongoDB search error: {e}")
-    
-    # Fall back to exact list comparison (case-sensitive)
-    if sender_id in sender_list:
-        return True
-    
-    return False
+    return sender_registry.is_known(sender_id)
+
+
+def run_analysis(image):
+    """Run the full OCR + VirusTotal + sender check pipeline and build the response dict"""
+    # Steps 1-2: Extract sender ID (top section) and full message text in one OCR pass
+    sender_id, message_text = ocr_screenshot(image)
+    return analyze_text(sender_id, message_text)
+
+
+def analyze_text(sender_id, message_text, check_urls=check_links):
+    """Steps 3-7 of the pipeline: URL checks, sender check and the response dict"""
+    # Step 3: Extract any URLs from that text
+    with timed('url_extraction'):
+        urls = extract_urls_from_text(message_text)
+
+    # Step 4: Check the URLs against the local lists, then VirusTotal (in parallel,
+    # through the shared rate limiter) for the ones they do not resolve
+    vt_results = []
+    if urls:
+        with timed('virustotal'):
+            vt_results = check_urls(urls)
+
+    return build_response(sender_id, message_text, urls, vt_results)
+
+
+def describe_lures(lures):
+    """'asks for a fee or payment and promises a prize' for a list of lure names"""
+    descriptions = [LURE_DESCRIPTIONS[name] for name in lures]
+    if len(descriptions) > 1:
+        return ', '.join(descriptions[:-1]) + ' and ' + descriptions[-1]
+    return descriptions[0] if descriptions else ''
+
+
+def build_response(sender_id, message_text, urls, vt_results):
+    """Steps 5-7 of the pipeline: sender and message checks, verdict and the response dict"""
+    url_results = []
+    if urls:
+        for url, vt_result in zip(urls, vt_results):
+            url_results.append({
+                'url': url,
+                'verdict': vt_result
+            })
+    else:
+        url_results.append({'message': 'No URLs found in the message'})
+
+    # Step 5: Determine if sender is legitimate, or imitating an official ID
+    with timed('sender_check'):
+        is_known = is_known_sender(sender_id)
+        lookalike_of = None if is_known else sender_registry.lookalike_of(sender_id)
+
+    # Step 5b: Score the message body from the same OCR text (no extra tesseract run)
+    with timed('message_classifier'):
+        text_score = score_message(message_text)
+    scam_text = text_score is not None and text_score.scam_score >= MESSAGE_SCAM_THRESHOLD
+    lure_advice = []
+    if text_score is not None and text_score.lures:
+        lure_advice = [f"The message {describe_lures(text_score.lures)}, a common smishing pattern."]
+
+    # Step 6: Build structured response
+    if is_known and scam_text:
+        # Sender IDs can be spoofed into the official thread, so the text gets a say
+        verdict = "Likely a Scam"
+        reason = f' (it {describe_lures(text_score.lures)})' if text_score.lures else ''
+        message = f'The sender ID <strong>"{sender_id}"</strong> matches an official HELB sender, but the message reads like a scam{reason}. Sender IDs can be spoofed, so do not act on this message.'
+        advice = [
+            "HELB never asks you to pay a fee to apply for, validate or receive a loan.",
+            "Confirm directly with HELB at www.helb.co.ke or by dialling *642# before acting.",
+            "Do not click on suspicious links.",
+            "Do not send money or share your PIN."
+        ]
+    elif is_known:
+        verdict = "Legitimate Message"
+        message = f'The sender ID <strong>"{sender_id}"</strong> is recognized as an official HELB communication channel. This message appears to be legitimate.'
+        advice = [
+            "Always confirm messages come from official sender IDs: **HELB**, **SurePay**, or **5122**.",
+            "You can safely interact with official HELB messages, but stay alert for unexpected links."
+        ]
+    elif lookalike_of:
+        verdict = "Likely a Scam"
+        message = f'The sender ID <strong>"{sender_id}"</strong> imitates the official HELB sender ID <strong>"{lookalike_of}"</strong> but does not match it. This is a common spoofing trick used in smishing attempts.'
+        advice = [
+            f"Official messages come from **{lookalike_of}** exactly, not look-alikes with swapped letters or digits.",
+            "HELB sends communication through **HELB**, **SurePay**, and **5122** only.",
+            *lure_advice,
+            "Do not click on suspicious links.",
+            "Block and report the sender immediately.",
+            "Delete the message to stay safe."
+        ]
+    else:
+        verdict = "Likely a Scam"
+        message = f'The sender ID <strong>"{sender_id}"</strong> is NOT recognized by HELB. This message shows signs of a potential smishing attempt.'
+        advice = [
+            "HELB sends communication through **HELB**, **SurePay**, and **5122** only.",
+            *lure_advice,
+            "Do not click on suspicious links.",
+            "Block and report the sender immediately.",
+            "Delete the message to stay safe."
+        ]
+
+    # Step 7: Combine all into final response
+    return {
+        'sender_id': sender_id if sender_id else "Sender not detected",
+        'is_known': is_known,
+        'lookalike_of': lookalike_of,
+        'verdict': verdict,
+        'message': message,
+        'advice': advice,
+        'message_analysis': text_score._asdict() if text_score is not None else None,
+        'urls_checked': url_results
+    }
+
+
+def persist_upload(image_bytes, filename):
+    """Write an upload to the uploads folder when PERSIST_UPLOADS is enabled"""
+    # Expired copies are removed by the retention sweeper, not on the request path
+    upload_store.save(image_bytes, filename)
+
+
+def cache_result(digest, result):
+    """Remember a result for repeat uploads unless one of its link checks failed"""
+    # Error verdicts (missing API key, quota, timeouts) are retried after the verdict
+    # cache's short backoff; the image cache would serve them for IMAGE_CACHE_TTL
+    if any((entry.get('verdict') or {}).get('verdict') == 'error' for entry in result['urls_checked']):
+        return
+    image_cache.put(digest, result)
+
+
+def run_cached_analysis(image_bytes, digest):
+    """Run the pipeline and remember the result for repeat uploads of the same screenshot"""
+    # The upload is decoded once here and the PIL image is shared by every OCR step
+    with timed('decode'):
+        image = decode_image(image_bytes)
+    with timed('total'):
+        result = run_analysis(image)
+    cache_result(digest, result)
+    return result
+
+
+# Background queue for POST /analyze?async=1; any worker can answer the polls
+job_queue = JobQueue(run_cached_analysis, store=shared_cache.namespace('jobs'))
+
+register_stats('virustotal_cache', verdict_cache.stats)
+register_stats('image_cache', image_cache.stats)
+register_stats('jobs', job_queue.stats)
+register_stats('ocr_strategy', ocr_strategy.stats)
+register_stats('uploads', upload_store.stats)
+register_stats('url_reputation', url_reputation.stats)
+register_stats('shared_cache', shared_cache.stats)
+
+# Cached results embed the sender and link verdicts; recompute them when the lists change
+sender_registry.on_change(image_cache.invalidate)
+url_reputation.on_change(image_cache.invalidate)
 
 
 @app.route('/analyze', methods=['POST'])
@@ -68,67 +221,169 @@ def analyze_image():
         return jsonify({'error': 'No image file provided'}), 400
 
     image_file = request.files['image']
-    image_path = os.path.join('uploads', image_file.filename)
-    image_file.save(image_path)
+    image_bytes = image_file.read()
 
+    # Size, format (magic bytes) and pixel limits are checked before anything is decoded
     try:
-        # Step 1: Extract sender ID from the top section of the image
-        sender_id = extract_sender_id(image_path)
+        check_upload(image_bytes, image_file.filename)
+    except UploadRejected as e:
+        ANALYSES.labels(endpoint='analyze', outcome='rejected').inc()
+        return jsonify({'error': str(e)}), e.status
 
-        # Step 2: Extract full text from the message body
-        message_text = extract_message_text(image_path)
+    # Byte-identical repeat uploads are answered from the cache, in both sync and async mode
+    digest = fingerprint(image_bytes)
+    cached = image_cache.get(digest)
+    if cached is not None:
+        ANALYSES.labels(endpoint='analyze', outcome='cached').inc()
+        return jsonify(cached)
 
-        # Step 3: Extract any URLs from that text
-        urls = extract_urls_from_text(message_text)
+    if app.config['PERSIST_UPLOADS']:
+        try:
+            persist_upload(image_bytes, image_file.filename)
+        except OSError as e:
+            logger.warning("Could not persist upload: %s", e)
 
-        # Step 4: Check each URL using VirusTotal
-        url_results = []
-        if urls:
-            for url in urls:
-                vt_result = verify_link_with_virustotal(url)
-                url_results.append({
-                    'url': url,
-                    'verdict': vt_result
-                })
-        else:
-            url_results.append({'message': 'No URLs found in the message'})
-
-        # Step 5: Determine if sender is legitimate
-        is_known = is_known_sender(sender_id)
+    # Async mode: queue the analysis and let the client poll /jobs/<id>
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        try:
+            job_id = job_queue.submit(image_bytes, digest)
+        except QueueFull as e:
+            ANALYSES.labels(endpoint='analyze_async', outcome='rejected').inc()
+            return jsonify({'error': f'Server busy: {e}. Please retry shortly.'}), 503, {'Retry-After': '5'}
+        ANALYSES.labels(endpoint='analyze_async', outcome='queued').inc()
+        return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'}), 202
 
-        # Step 6: Build structured response
-        if is_known:
-            verdict = "Legitimate Message"
-            message = f'The sender ID <strong>"{sender_id}"</strong> is recognized as an official HELB communication channel. This message appears to be legitimate.'
-            advice = [
-                "Always confirm messages come from official sender IDs: **HELB**, **SurePay**, or **5122**.",
-                "You can safely interact with official HELB messages, but stay alert for unexpected links."
-            ]
-        else:
-            verdict = "Likely a Scam"
-            message = f'The sender ID <strong>"{sender_id}"</strong> is NOT recognized by HELB. This message shows signs of a potential smishing attempt.'
-            advice = [
-                "HELB sends communication through **HELB**, **SurePay**, and **5122** only.",
-                "Do not click on suspicious links.",
-                "Block and report the sender immediately.",
-                "Delete the message to stay safe."
-            ]
-
-        # Step 7: Combine all into final response
-        response = {
-            'sender_id': sender_id if sender_id else "Sender not detected",
-            'is_known': is_known,
-            'verdict': verdict,
-            'message': message,
-            'advice': advice,
-            'urls_checked': url_results
-        }
-
-        return jsonify(response)
+    try:
+        result = run_cached_analysis(image_bytes, digest)
+        ANALYSES.labels(endpoint='analyze', outcome='ok').inc()
+        return jsonify(result)
 
+    except UploadRejected as e:
+        # Truncated or corrupt files only show up once the pixels are decoded
+        ANALYSES.labels(endpoint='analyze', outcome='rejected').inc()
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
+        logger.exception("Analysis failed")
+        ANALYSES.labels(endpoint='analyze', outcome='error').inc()
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analyse many screenshots at once. Accepts image parts and/or zip archives
+    (any field name) and streams one NDJSON line per image as each finishes,
+    each holding the /analyze response plus its `index` and `filename`.
+    """
+    try:
+        uploads = collect_uploads(f for files in request.files.listvalues() for f in files)
+    except BatchTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': f'Could not read batch: {e}'}), 400
+    if not uploads:
+        return jsonify({'error': 'No image files provided'}), 400
+
+    return Response(stream_with_context(_stream_batch(uploads)), mimetype='application/x-ndjson')
+
+
+def _stream_batch(uploads):
+    # Each distinct URL in the batch is sent to VirusTotal once
+    batch_verdicts = {}
+
+    def check_urls(urls):
+        new = [url for url in dict.fromkeys(urls) if url not in batch_verdicts]
+        batch_verdicts.update(zip(new, check_links(new)))
+        return [dict(batch_verdicts[url]) for url in urls]
+
+    def line(index, filename, result):
+        return json.dumps({'index': index, 'filename': filename, **result}) + '\n'
+
+    def finish(future):
+        index, filename, digest = pending.pop(future)
+        try:
+            sender_id, message_text = future.result()
+            result = analyze_text(sender_id, message_text, check_urls)
+            cache_result(digest, result)
+            ANALYSES.labels(endpoint='batch', outcome='ok').inc()
+        except Exception as e:
+            ANALYSES.labels(endpoint='batch', outcome='error').inc()
+            result = {'error': str(e)}
+        return line(index, filename, result)
+
+    # Images are read one at a time and at most BATCH_MAX_PENDING wait for OCR,
+    # so a batch never holds all of its images in memory
+    pending = {}
+    for index, entry in enumerate(uploads):
+        filename = entry.filename
+        try:
+            image_bytes = entry.read()
+            if image_bytes is None:
+                raise UploadRejected('Image too large')
+            check_upload(image_bytes, filename)
+        except UploadRejected as e:
+            ANALYSES.labels(endpoint='batch', outcome='rejected').inc()
+            yield line(index, filename, {'error': str(e)})
+            continue
+        except Exception as e:
+            # A corrupt zip entry fails only once it is inflated
+            ANALYSES.labels(endpoint='batch', outcome='rejected').inc()
+            yield line(index, filename, {'error': f'Could not read image: {e}'})
+            continue
+        digest = fingerprint(image_bytes)
+        cached = image_cache.get(digest)
+        if cached is not None:
+            ANALYSES.labels(endpoint='batch', outcome='cached').inc()
+            yield line(index, filename, cached)
+            continue
+        pending[submit_ocr(image_bytes)] = (index, filename, digest)
+        if len(pending) >= BATCH_MAX_PENDING:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield finish(future)
+
+    for future in as_completed(list(pending)):
+        yield finish(future)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll an async analysis; returns the /analyze response once the job is done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job id'}), 404
+    if job['status'] == 'done':
+        return jsonify(job['result'])
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    return jsonify({'job_id': job_id, 'status': job['status']}), 202
+
+
+@app.route('/jobs/stats', methods=['GET'])
+def job_stats():
+    """Queue depth and job counters for the async analyze mode"""
+    return jsonify(job_queue.stats())
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the result caches"""
+    return jsonify({'virustotal': verdict_cache.stats(), 'images': image_cache.stats()})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the OCR pool is warm and the sender registry is loaded"""
+    is_ready, details = startup.readiness()
+    return jsonify(details), (200 if is_ready else 503)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage latencies, OCR config wins, cache and queue stats"""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""
+ASGI entry point for the analyze API.
+
+    pip install starlette httpx uvicorn python-multipart
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+Serves POST /analyze with the same request and response contract as the
+Flask app (including ?async=1 and the result cache), plus /jobs, /ready,
+/cache/stats and /metrics. /analyze/batch stays on the WSGI app.
+
+One event loop multiplexes all uploads. Decoding and OCR run on a thread
+pool of ASGI_OCR_CONCURRENCY threads behind a semaphore. Fingerprinting,
+the result and verdict caches (SQLite or Redis I/O) and the sender and URL
+list reloads (which may query MongoDB) run on the default thread pool, so
+the loop never blocks on CPU work or storage, and VirusTotal is awaited
+through httpx. Uploads waiting for an OCR slot are capped at
+ASGI_MAX_PENDING; beyond that the API answers 503 with Retry-After, like the
+async job queue. Request bodies over MAX_CONTENT_LENGTH are refused with 413
+from their Content-Length, or as soon as the streamed body passes it.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Importing app loads .env, configures logging and shares the pipeline code
+import app as wsgi
+import ocr_pool
+import startup
+from helpers import extract_urls_from_text
+from image_cache import fingerprint, image_cache
+from ingest import INGEST_MAX_BYTES, UploadRejected, check_upload
+from jobs import QueueFull
+from metrics import ANALYSES, render_metrics, timed
+from url_reputation import check_links_async
+from virustotal import close_async_client
+from vt_cache import verdict_cache
+
+logger = logging.getLogger(__name__)
+
+ASGI_OCR_CONCURRENCY = int(os.getenv("ASGI_OCR_CONCURRENCY", str(ocr_pool.OCR_POOL_SIZE)))
+ASGI_MAX_PENDING = int(os.getenv("ASGI_MAX_PENDING", "50"))
+
+_ocr = {'executor': None, 'semaphore': None, 'pending': 0}
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class BodyLimitMiddleware:
+    """The ASGI counterpart of Flask's MAX_CONTENT_LENGTH"""
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.max_bytes:
+            return await self.app(scope, receive, send)
+        length = dict(scope['headers']).get(b'content-length', b'')
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(scope, receive, send)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    raise BodyTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            started = started or message['type'] == 'http.response.start'
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except BodyTooLarge:
+            if started:
+                raise
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        ANALYSES.labels(endpoint='analyze', outcome='rejected').inc()
+        limit_mb = self.max_bytes // (1024 * 1024)
+        response = JSONResponse({'error': f'Upload too large (limit {limit_mb} MB)'}, status_code=413)
+        await response(scope, receive, send)
+
+
+def _ocr_upload(image_bytes):
+    """Decode and OCR an upload; runs on the OCR thread pool"""
+    with timed('decode'):
+        image = wsgi.decode_image(image_bytes)
+    return wsgi.ocr_screenshot(image)
+
+
+async def _run_ocr(func, *args):
+    """Run CPU-bound work off the loop, at most ASGI_OCR_CONCURRENCY at a time"""
+    if _ocr['pending'] >= ASGI_MAX_PENDING:
+        raise QueueFull(f"{ASGI_MAX_PENDING} analyses already pending")
+    _ocr['pending'] += 1
+    try:
+        async with _ocr['semaphore']:
+            return await asyncio.get_running_loop().run_in_executor(_ocr['executor'], func, *args)
+    finally:
+        _ocr['pending'] -= 1
+
+
+async def analyze(request):
+    form = await request.form()
+    upload = form.get('image')
+    if upload is None or isinstance(upload, str):
+        return JSONResponse({'error': 'No image file provided'}, status_code=400)
+    # Anything past INGEST_MAX_BYTES is rejected by check_upload; never buffer more
+    image_bytes = await upload.read(INGEST_MAX_BYTES + 1)
+    is_async = request.query_params.get('async', '').lower() in ('1', 'true', 'yes')
+
+    try:
+        check_upload(image_bytes, upload.filename)
+    except UploadRejected as e:
+        ANALYSES.labels(endpoint='analyze', outcome='rejected').inc()
+        return JSONResponse({'error': str(e)}, status_code=e.status)
+
+    try:
+        # Hashing runs off the OCR slots so cache hits never queue behind OCR
+        digest = await asyncio.to_thread(fingerprint, image_bytes)
+        cached = await asyncio.to_thread(image_cache.get, digest)
+        if cached is not None:
+            ANALYSES.labels(endpoint='analyze', outcome='cached').inc()
+            return JSONResponse(cached)
+
+        if wsgi.app.config['PERSIST_UPLOADS']:
+            try:
+                await asyncio.to_thread(wsgi.persist_upload, image_bytes, upload.filename)
+            except OSError as e:
+                logger.warning("Could not persist upload: %s", e)
+
+        if is_async:
+            job_id = await asyncio.to_thread(wsgi.job_queue.submit, image_bytes, digest)
+            ANALYSES.labels(endpoint='analyze_async', outcome='queued').inc()
+            return JSONResponse({'job_id': job_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'},
+                                status_code=202)
+
+        with timed('total'):
+            sender_id, message_text = await _run_ocr(_ocr_upload, image_bytes)
+            with timed('url_extraction'):
+                urls = extract_urls_from_text(message_text)
+            vt_results = []
+            if urls:
+                with timed('virustotal'):
+                    vt_results = await check_links_async(urls)
+            result = await asyncio.to_thread(wsgi.build_response, sender_id, message_text, urls, vt_results)
+        await asyncio.to_thread(wsgi.cache_result, digest, result)
+        ANALYSES.labels(endpoint='analyze', outcome='ok').inc()
+        return JSONResponse(result)
+
+    except QueueFull as e:
+        ANALYSES.labels(endpoint='analyze_async' if is_async else 'analyze', outcome='rejected').inc()
+        return JSONResponse({'error': f'Server busy: {e}. Please retry shortly.'}, status_code=503,
+                            headers={'Retry-After': '5'})
+    except UploadRejected as e:
+        ANALYSES.labels(endpoint='analyze', outcome='rejected').inc()
+        return JSONResponse({'error': str(e)}, status_code=e.status)
+    except Exception as e:
+        logger.exception("Analysis failed")
+        ANALYSES.labels(endpoint='analyze', outcome='error').inc()
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def get_job(request):
+    job_id = request.path_params['job_id']
+    job = await asyncio.to_thread(wsgi.job_queue.get, job_id)
+    if job is None:
+        return JSONResponse({'error': 'Unknown or expired job id'}, status_code=404)
+    if job['status'] == 'done':
+        return JSONResponse(job['result'])
+    if job['status'] == 'failed':
+        return JSONResponse({'error': job['error']}, status_code=500)
+    return JSONResponse({'job_id': job_id, 'status': job['status']}, status_code=202)
+
+
+async def job_stats(request):
+    return JSONResponse(wsgi.job_queue.stats())
+
+
+async def cache_stats(request):
+    return JSONResponse({'virustotal': verdict_cache.stats(), 'images': image_cache.stats()})
+
+
+async def ready(request):
+    is_ready, details = await asyncio.to_thread(startup.readiness)
+    details['ocr_pending'] = _ocr['pending']
+    return JSONResponse(details, status_code=200 if is_ready else 503)
+
+
+async def metrics(request):
+    body, content_type = render_metrics()
+    return Response(body, headers={'Content-Type': content_type})
+
+
+@asynccontextmanager
+async def lifespan(application):
+    startup.init_worker()
+    _ocr['executor'] = ThreadPoolExecutor(max_workers=ASGI_OCR_CONCURRENCY, thread_name_prefix='asgi-ocr')
+    _ocr['semaphore'] = asyncio.Semaphore(ASGI_OCR_CONCURRENCY)
+    try:
+        yield
+    finally:
+        await close_async_client()
+        _ocr['executor'].shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/analyze', analyze, methods=['POST']),
+        Route('/jobs/stats', job_stats, methods=['GET']),
+        Route('/jobs/{job_id}', get_job, methods=['GET']),
+        Route('/cache/stats', cache_stats, methods=['GET']),
+        Route('/ready', ready, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(BodyLimitMiddleware, max_bytes=wsgi.app.config['MAX_CONTENT_LENGTH']),
+    ],
+    lifespan=lifespan,
+)
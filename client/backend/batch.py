@@ -0,0 +1,103 @@
+"""
+Helpers for POST /analyze/batch: unpacking the uploaded images and running
+their OCR on a process pool so tesseract work uses every core.
+
+A batch is checked against its limits (image count, total uncompressed
+bytes, zip compression ratio) from the zip directories before anything is
+inflated. Only the uploaded parts themselves, already bounded by
+MAX_CONTENT_LENGTH, are kept in memory; zip entries are inflated one at a time
+as they are handed to the pool, with at most BATCH_MAX_PENDING in flight.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers import ocr_screenshot_bytes
+from ingest import INGEST_MAX_BYTES
+
+BATCH_PROCESSES = int(os.getenv("BATCH_PROCESSES", str(os.cpu_count() or 1)))
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "500"))
+# Largest image accepted from inside a zip archive (uncompressed bytes)
+BATCH_MAX_IMAGE_BYTES = int(os.getenv("BATCH_MAX_IMAGE_BYTES", str(INGEST_MAX_BYTES)))
+# All images of one batch together (uncompressed bytes)
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(200 * 1024 * 1024)))
+# JPEG and PNG are already compressed; a zip entry that inflates more than this is a zip bomb
+BATCH_MAX_COMPRESSION_RATIO = float(os.getenv("BATCH_MAX_COMPRESSION_RATIO", "20"))
+# Images read and queued for OCR but not yet finished
+BATCH_MAX_PENDING = int(os.getenv("BATCH_MAX_PENDING", str(2 * max(1, BATCH_PROCESSES))))
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# read() returns the image bytes, or None for a zip entry too large to read
+BatchEntry = namedtuple('BatchEntry', ['filename', 'size', 'read'])
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+class BatchTooLarge(Exception):
+    """Raised when a batch exceeds BATCH_MAX_IMAGES, BATCH_MAX_TOTAL_BYTES or the zip ratio limit"""
+
+
+def get_executor():
+    """Process pool for batch OCR, created on first use in each server process"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # spawn: children must not inherit the server's threads, locks or OCR handles
+            _executor = ProcessPoolExecutor(max_workers=max(1, BATCH_PROCESSES),
+                                            mp_context=multiprocessing.get_context('spawn'))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def submit_ocr(image_bytes):
+    """Queue OCR of one image; the future resolves to (sender_id, message_text)"""
+    return get_executor().submit(ocr_screenshot_bytes, image_bytes)
+
+
+def _entries_from_zip(data):
+    """BatchEntry for every image in a zip, checked from its directory without inflating anything"""
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    for info in archive.infolist():
+        if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        if info.file_size > BATCH_MAX_IMAGE_BYTES:
+            yield BatchEntry(info.filename, 0, lambda: None)
+            continue
+        if info.file_size > BATCH_MAX_COMPRESSION_RATIO * max(info.compress_size, 1):
+            raise BatchTooLarge(f"Zip entry {info.filename} is compressed more than "
+                                f"{BATCH_MAX_COMPRESSION_RATIO:g}:1; screenshots do not compress like that")
+        yield BatchEntry(info.filename, info.file_size, lambda info=info: archive.read(info))
+
+
+def collect_uploads(files):
+    """
+    Return a BatchEntry for every image in a multipart upload. Accepts any
+    number of image parts plus zip archives of images; zip entries too large
+    to read get a read() returning None so they can be reported. Raises
+    BatchTooLarge before any zip entry is inflated if the batch is over its limits.
+    """
+    entries = []
+    total = 0
+    for storage in files:
+        name = storage.filename or 'upload'
+        data = storage.read()
+        if name.lower().endswith('.zip') or zipfile.is_zipfile(io.BytesIO(data)):
+            found = _entries_from_zip(data)
+        else:
+            found = [BatchEntry(name, len(data), lambda data=data: data)]
+        for entry in found:
+            entries.append(entry)
+            total += entry.size
+            if len(entries) > BATCH_MAX_IMAGES:
+                raise BatchTooLarge(f"A batch may contain at most {BATCH_MAX_IMAGES} images")
+            if total > BATCH_MAX_TOTAL_BYTES:
+                raise BatchTooLarge(f"A batch may contain at most "
+                                    f"{BATCH_MAX_TOTAL_BYTES // (1024 * 1024)} MB of images")
+    return entries
@@ -0,0 +1,270 @@
+"""
+Benchmark and accuracy guardrail for the OCR pipeline.
+
+Runs extract_sender_id, extract_message_text, the message classifier and
+the full /analyze handler over the labelled screenshots in corpus.json and
+reports throughput, p50/p95/p99 latency, peak RSS and sender-ID / URL
+extraction / verdict accuracy.
+Results are compared against baseline.json; an accuracy drop (or, with
+--strict, a latency regression beyond --tolerance) exits non-zero.
+
+VirusTotal is replaced by a local fake with a fixed latency and the image
+result cache is disabled so every run exercises the real OCR path.
+
+Usage (from client/backend):
+    python benchmarks/bench.py                     # pipeline benchmark
+    python benchmarks/bench.py --update-baseline   # record a new baseline
+    python benchmarks/bench.py --load --concurrency 8 --requests 64
+    python benchmarks/bench.py --load --url http://localhost:8000/analyze
+"""
+import argparse
+import io
+import json
+import os
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# Isolate the run from real caches and credentials before the app modules load
+os.environ['IMAGE_CACHE_SIZE'] = '0'
+os.environ['VT_API_KEY'] = 'benchmark-fake-key'
+_state_dir = tempfile.mkdtemp(prefix='helbme-bench-')
+os.environ['SHARED_CACHE_URL'] = 'sqlite:///' + os.path.join(_state_dir, 'shared_cache.sqlite3')
+os.environ['OCR_STRATEGY_DB'] = os.path.join(_state_dir, 'ocr_strategy.sqlite3')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+FAKE_VT_LATENCY = float(os.getenv('BENCH_FAKE_VT_LATENCY', '0.15'))
+
+
+def fake_virustotal(url_id):
+    """Stand-in for the VirusTotal API: fixed latency, deterministic verdict"""
+    time.sleep(FAKE_VT_LATENCY)
+    return {"verdict": "clean", "details": "Benchmark fake VirusTotal"}
+
+
+def normalize_sender(value):
+    return re.sub(r'[^0-9a-z]', '', (value or '').casefold())
+
+
+def normalize_url(url):
+    return url.rstrip('.,;:!?)\'"').lower()
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {'p50': round(pick(50) * 1000, 1), 'p95': round(pick(95) * 1000, 1),
+            'p99': round(pick(99) * 1000, 1), 'n': len(ordered)}
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    for entry in corpus:
+        with open(os.path.join(BACKEND_DIR, entry['file']), 'rb') as f:
+            entry['bytes'] = f.read()
+    return corpus
+
+
+def run_pipeline(corpus, repeat):
+    import app as backend
+    import helpers
+    import virustotal
+    from message_classifier import score_message
+    virustotal._fetch_virustotal_verdict = fake_virustotal
+
+    client = backend.app.test_client()
+    timings = {'extract_sender_id': [], 'extract_message_text': [], 'score_message': [], 'analyze': []}
+    scores = {'sender_correct': 0, 'known_correct': 0, 'verdict_correct': 0, 'url_expected': 0, 'url_found': 0,
+              'url_matched': 0, 'images': 0}
+    failures = []
+
+    started = time.perf_counter()
+    for run in range(repeat):
+        for entry in corpus:
+            image = helpers.decode_image(entry['bytes'])
+
+            t = time.perf_counter()
+            helpers.extract_sender_id(image)
+            timings['extract_sender_id'].append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            message_text = helpers.extract_message_text(image)
+            timings['extract_message_text'].append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            score_message(message_text)
+            timings['score_message'].append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            response = client.post('/analyze', data={'image': (io.BytesIO(entry['bytes']), os.path.basename(entry['file']))},
+                                   content_type='multipart/form-data')
+            timings['analyze'].append(time.perf_counter() - t)
+
+            result = response.get_json() or {}
+            scores['images'] += 1
+            sender_ok = normalize_sender(result.get('sender_id')) == normalize_sender(entry['sender_id'])
+            known_ok = result.get('is_known') == entry['is_known']
+            verdict_ok = (result.get('verdict') != 'Legitimate Message') == entry['scam']
+            scores['sender_correct'] += sender_ok
+            scores['known_correct'] += known_ok
+            scores['verdict_correct'] += verdict_ok
+
+            expected_urls = {normalize_url(u) for u in entry['urls']}
+            found_urls = {normalize_url(item['url']) for item in result.get('urls_checked', []) if 'url' in item}
+            scores['url_expected'] += len(expected_urls)
+            scores['url_found'] += len(found_urls)
+            scores['url_matched'] += len(expected_urls & found_urls)
+            if run == 0 and not (sender_ok and known_ok and verdict_ok and expected_urls == found_urls):
+                failures.append({'file': entry['file'], 'sender_id': result.get('sender_id'),
+                                 'is_known': result.get('is_known'), 'verdict': result.get('verdict'),
+                                 'urls': sorted(found_urls)})
+    elapsed = time.perf_counter() - started
+
+    images = scores['images']
+    return {
+        'accuracy': {
+            'sender_id': round(scores['sender_correct'] / images, 4),
+            'is_known': round(scores['known_correct'] / images, 4),
+            'verdict': round(scores['verdict_correct'] / images, 4),
+            'url_recall': round(scores['url_matched'] / scores['url_expected'], 4) if scores['url_expected'] else 1.0,
+            'url_precision': round(scores['url_matched'] / scores['url_found'], 4) if scores['url_found'] else 1.0,
+        },
+        'latency_ms': {stage: percentiles(samples) for stage, samples in timings.items()},
+        'throughput_images_per_s': round(images / elapsed, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'mismatches': failures,
+    }
+
+
+def run_load(corpus, url, concurrency, total):
+    """Fire `total` /analyze requests with `concurrency` clients at a running server"""
+    import requests
+
+    server = None
+    if url is None:
+        import app as backend
+        import virustotal
+        from werkzeug.serving import make_server
+        virustotal._fetch_virustotal_verdict = fake_virustotal
+        server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/analyze'
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        entry = corpus[i % len(corpus)]
+        t = time.perf_counter()
+        try:
+            response = requests.post(url, files={'image': (os.path.basename(entry['file']), entry['bytes'])},
+                                     timeout=120)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        with lock:
+            latencies.append(time.perf_counter() - t)
+            errors += not ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    if server is not None:
+        server.shutdown()
+
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': errors,
+        'throughput_rps': round(total / elapsed, 3),
+        'latency_ms': percentiles(latencies),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return (accuracy regressions, latency regressions) against the baseline"""
+    accuracy = [f"{key}: {report['accuracy'][key]} < baseline {value}"
+                for key, value in baseline.get('accuracy', {}).items()
+                if report['accuracy'].get(key, 0) < value]
+    latency = []
+    for stage, stats in baseline.get('latency_ms', {}).items():
+        current = report['latency_ms'].get(stage, {})
+        for key in ('p50', 'p95'):
+            if key in stats and key in current and current[key] > stats[key] * (1 + tolerance):
+                latency.append(f"{stage} {key}: {current[key]} ms > baseline {stats[key]} ms")
+    return accuracy, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=os.path.join(BENCH_DIR, 'corpus.json'))
+    parser.add_argument('--baseline', default=os.path.join(BENCH_DIR, 'baseline.json'))
+    parser.add_argument('--update-baseline', action='store_true', help='write this run as the new baseline')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the corpus')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed latency regression (fraction)')
+    parser.add_argument('--strict', action='store_true', help='fail on latency regressions too')
+    parser.add_argument('--load', action='store_true', help='concurrency load test instead of the pipeline run')
+    parser.add_argument('--url', help='analyze endpoint of a running server (default: in-process server)')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=32)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+
+    if args.load:
+        print(json.dumps(run_load(corpus, args.url, args.concurrency, args.requests), indent=2))
+        return 0
+
+    report = run_pipeline(corpus, args.repeat)
+    print(json.dumps(report, indent=2))
+
+    if args.update_baseline:
+        baseline = {key: report[key] for key in ('accuracy', 'latency_ms', 'throughput_images_per_s', 'peak_rss_mb')}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --update-baseline to record one")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    accuracy, latency = compare(report, baseline, args.tolerance)
+    for line in accuracy:
+        print(f"ACCURACY REGRESSION {line}")
+    for line in latency:
+        print(f"LATENCY REGRESSION {line}")
+    if accuracy or (args.strict and latency):
+        return 1
+    print("No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""
+gunicorn settings, picked up automatically by `gunicorn app:app` in this directory.
+
+The app is imported once in the master (preload) so Flask, PIL, NumPy and the
+sender registry are shared copy-on-write by the workers. Everything that is
+not fork-safe (OCR engines, MongoDB client, SQLite connections, threads) is
+created per worker, starting from post_fork.
+
+Workers are gthread: requests run on worker threads while the main loop keeps
+sending the heartbeat, so a long /analyze/batch stream is not killed by
+`timeout` and a worker keeps serving other requests while a batch runs.
+"""
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").lower() in ('1', 'true', 'yes')
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Only a worker whose main loop stops (or a sync worker's request) hits this
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+def post_fork(server, worker):
+    import startup
+    startup.init_worker()
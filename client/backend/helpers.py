@@ -1,20 +1,71 @@
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageFile
-ImageFile.LOAD_TRUNCATED_IMAGES = True
+from PIL import Image, ImageEnhance
+import numpy as np
 import pytesseract
 import shutil
 import os
 import re
-import time
+import logging
 import os
 from dotenv import load_dotenv
-import requests
-import base64
 
 load_dotenv()
-VT_API_KEY = os.getenv("VT_API_KEY")
+
+import ocr_pool
+from ingest import decode_upload
+from layout import detect_layout
+from ocr_strategy import strategy as ocr_strategy
+from metrics import SENDER_OCR_LATENCY, SENDER_SOURCE, timed
+from sender_parser import parse_sender_candidates
+from url_reputation import clean_url, parse_url
+from virustotal import verify_link_with_virustotal, verify_links_with_virustotal
+
+logger = logging.getLogger(__name__)
+
+# Header region (fractions of the screenshot) where the sender ID appears
+HEADER_LEFT_RATIO = 0.125
+HEADER_RIGHT_RATIO = 0.60
+HEADER_HEIGHT_RATIO = 0.1
+HEADER_MIN_HEIGHT = 115
+
+# Bradley threshold: ink must be this many percent darker than its neighbourhood
+THRESHOLD_PERCENT = 15
+# Neighbourhood radius cap; keeps window sums * 100 within int32
+ADAPTIVE_MAX_RADIUS = 64
+
+# OCR configurations tried when the single-pass sender ID is unreliable (order is adapted per layout)
+SENDER_OCR_CONFIGS = [
+    r'--oem 3 --psm 7',  # Single line of text (best for sender ID)
+    r'--oem 3 --psm 6',  # Assume uniform block of text
+    r'--oem 3 --psm 11', # Sparse text
+    r'--oem 3 --psm 13', # Raw line (no layout analysis)
+]
+
+# Full-page layout pass (same settings the message body has always used)
+PAGE_OCR_CONFIG = r'--oem 3 --psm 6'
+
+# Word confidence (0-100) a sender ID candidate needs to be accepted without further OCR passes
+SENDER_MIN_CONFIDENCE = float(os.getenv("SENDER_MIN_CONFIDENCE", "70"))
+# Candidate kinds (see sender_parser) that can be accepted on confidence alone
+SENDER_CONFIDENT_KINDS = ('known', 'phone', 'shortcode', 'alpha')
+
+_tesseract_configured = False
+
 
 def _configure_tesseract():
-    """Configure tesseract binary path"""
+    """Configure tesseract binary path (probed once per process)"""
+    global _tesseract_configured
+    if _tesseract_configured:
+        return
+    # The tesserocr pool links libtesseract directly and needs no binary
+    if ocr_pool.get_pool() is not None:
+        _tesseract_configured = True
+        return
+    _resolve_tesseract_cmd()
+    _tesseract_configured = True
+
+
+def _resolve_tesseract_cmd():
+    """Point pytesseract at the tesseract binary or raise RuntimeError"""
     current = getattr(pytesseract.pytesseract, 'tesseract_cmd', None)
     if current and os.path.exists(current):
         return
@@ -51,27 +102,128 @@ def _configure_tesseract():
     )
 
 
-def preprocess_image(image_path):
+def decode_image(data):
+    """Decode uploaded image bytes (bytes or memoryview) into a PIL image, fully loaded"""
+    # Bounded by ingest.py: pixel limit, no truncated files, downscaled to what OCR needs
+    return decode_upload(data)
+
+
+def ocr_screenshot_bytes(data):
+    """ocr_screenshot for raw upload bytes (picklable entry point for process pools)"""
+    return ocr_screenshot(decode_image(data))
+
+
+def _open_image(image):
+    """Return a PIL image for either a file path or an already decoded image"""
+    if isinstance(image, Image.Image):
+        return image
+    return Image.open(image)
+
+
+def _header_box(width, height, layout=None):
+    """Box (left, top, right, bottom) of the header region holding the sender ID"""
+    if layout is not None:
+        # Detected header bar (status bar excluded)
+        top, crop_height = layout.header[1], layout.header[3]
+    else:
+        # Focus on top 120 pixels (or 10% of height, whichever is larger)
+        top, crop_height = 0, max(HEADER_MIN_HEIGHT, int(height * HEADER_HEIGHT_RATIO))
+
+    # Also crop from the left side to avoid back button and other UI elements
+    # Start from 12.5% of width to skip the back arrow
+    left_margin = int(width * HEADER_LEFT_RATIO)
+    right_boundary = int(width * HEADER_RIGHT_RATIO)  # Only take left portion of header
+
+    return (left_margin, top, right_boundary, crop_height)
+
+
+def _box_sums(arr, radius):
+    """
+    Sum of `arr` over a (2*radius+1)^2 window around every pixel, clipped at
+    the borders, computed separably from running sums. Returns (sums, counts).
+    """
+    height, width = arr.shape
+    # int32 is enough unless the whole array could sum past 2**31
+    dtype = np.int32 if arr.size * 255 < 2 ** 31 else np.int64
+
+    y0 = np.clip(np.arange(height) - radius, 0, height)
+    y1 = np.clip(np.arange(height) + radius + 1, 0, height)
+    x0 = np.clip(np.arange(width) - radius, 0, width)
+    x1 = np.clip(np.arange(width) + radius + 1, 0, width)
+
+    # Vertical window sums
+    running = np.zeros((height + 1, width), dtype=dtype)
+    np.cumsum(arr, axis=0, dtype=dtype, out=running[1:])
+    vertical = running.take(y1, axis=0)
+    vertical -= running.take(y0, axis=0)
+
+    # Horizontal window sums of the vertical sums
+    running = np.zeros((height, width + 1), dtype=dtype)
+    np.cumsum(vertical, axis=1, dtype=dtype, out=running[:, 1:])
+    sums = running.take(x1, axis=1)
+    sums -= running.take(x0, axis=1)
+
+    counts = np.outer(y1 - y0, x1 - x0).astype(dtype)
+    return sums, counts
+
+
+def _adaptive_threshold(gray, percent=THRESHOLD_PERCENT):
+    """
+    Bradley local thresholding: a pixel becomes ink (0) when it is at least
+    `percent`% darker than the mean of its neighbourhood, paper (255) otherwise.
+    """
+    radius = min(ADAPTIVE_MAX_RADIUS, max(7, min(gray.shape) // 8))
+    sums, counts = _box_sums(gray, radius)
+    # gray * counts * 100 <= sums * (100 - percent), kept in integers
+    counts *= gray
+    counts *= 100
+    sums *= 100 - percent
+    return np.where(counts <= sums, np.uint8(0), np.uint8(255))
+
+
+def _denoise(binary):
+    """3x3 majority filter (the binary equivalent of a median filter)"""
+    ink = binary == 0
+    sums, counts = _box_sums(ink.view(np.uint8), 1)
+    return np.where(sums * 2 > counts, np.uint8(0), np.uint8(255))
+
+
+def _detect_layout(img):
+    """detect_layout that never fails a request; None falls back to the fixed header box"""
+    try:
+        with timed('layout'):
+            return detect_layout(img)
+    except Exception as e:
+        logger.warning("Layout detection failed: %s", e)
+        return None
+
+
+def _page_region(img, layout):
+    """
+    Crop a screenshot to its header and message bubbles and scale it to the
+    resolution OCR needs. Returns (page, top, scale) to map boxes onto the page.
+    """
+    if layout is None:
+        return img, 0, 1.0
+    page = img.crop(layout.body)
+    if layout.scale < 1.0:
+        size = (max(1, round(page.width * layout.scale)), max(1, round(page.height * layout.scale)))
+        page = page.resize(size, Image.Resampling.BILINEAR)
+    return page, layout.body[1], layout.scale
+
+
+def preprocess_image(image, layout=None):
     """Preprocess image for better OCR accuracy - optimized for message screenshots"""
-    img = Image.open(image_path)
-    
-    # Convert to RGB if necessary
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
+    img = _open_image(image)
     
     # Get image dimensions
     width, height = img.size
     
     # For message screenshots, crop to the top portion where sender ID appears
-    # Focus on top 120 pixels (or 10% of height, whichever is larger)
-    crop_height = max(115, int(height * 0.1))
-    
-    # Also crop from the left side to avoid back button and other UI elements
-    # Start from 15% of width to skip the back arrow
-    left_margin = int(width * 0.125)
-    right_boundary = int(width * 0.60)  # Only take left portion of header
-    
-    img = img.crop((left_margin, 0, right_boundary, crop_height))
+    # and convert to grayscale (both in C, on the header region only)
+    img = img.crop(_header_box(width, height, layout))
+    if img.mode != 'L':
+        img = img.convert('L')
     
     # Resize for better OCR (aim for width of 1000-1500px)
     width, height = img.size
@@ -80,313 +232,246 @@ def preprocess_image(image_path):
         new_size = (int(width * scale_factor), int(height * scale_factor))
         img = img.resize(new_size, Image.Resampling.LANCZOS)
     
-    # Convert to grayscale
-    img = img.convert('L')
+    # Work on a writable uint8 array from here on
+    gray = np.array(img, dtype=np.uint8)
     
     # Invert if background is dark (common in message apps)
-    # Check average brightness
-    img_array = list(img.getdata())
-    avg_brightness = sum(img_array) / len(img_array)
-    if avg_brightness < 127:  # Dark background
-        img = ImageOps.invert(img)
-    
-    # Apply adaptive thresholding
-    img = ImageOps.autocontrast(img, cutoff=5)
+    if gray.mean() < 127:  # Dark background
+        np.subtract(255, gray, out=gray)
     
-    # Enhance contrast
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(2.5)
+    # Local thresholding copes with gradients and coloured header bars
+    binary = _denoise(_adaptive_threshold(gray))
     
-    # Enhance sharpness
-    enhancer = ImageEnhance.Sharpness(img)
-    img = enhancer.enhance(2.0)
-    
-    # Reduce noise
-    img = img.filter(ImageFilter.MedianFilter(size=3))
+    # Hand the contiguous buffer to the OCR engine without another copy
+    img = Image.fromarray(np.ascontiguousarray(binary))
     
     # Optional: Save preprocessed image for debugging
-    debug_path = image_path.replace('.jpg', '_preprocessed.jpg').replace('.png', '_preprocessed.png').replace('.jpeg', '_preprocessed.jpeg')
+    if isinstance(image, Image.Image):
+        return img
+    debug_path = image.replace('.jpg', '_preprocessed.jpg').replace('.png', '_preprocessed.png').replace('.jpeg', '_preprocessed.jpeg')
     img.save(debug_path)
-    print(f"[DEBUG] Preprocessed image saved to: {debug_path}")
+    logger.debug("Preprocessed image saved to: %s", debug_path)
     
     return img
 
 
 def clean_sender_id(raw_text):
-    """Clean and extract sender ID from OCR text"""
-    if not raw_text:
-        return None
-    
-    print(f"[DEBUG] Raw OCR text: '{raw_text}'")
-    
-    # Split into lines and get all non-empty lines
-    lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
-    if not lines:
-        return None
-    
-    print(f"[DEBUG] Lines extracted: {lines}")
-    
-    # Known HELB sender IDs - EXACT formats only for security
-    # These must match exactly as they appear in legitimate HELB messages
-    known_senders_exact = ['HELB', 'SurePay', '5122']
-    
-    # Try each line to find the sender ID
-    for line in lines[:5]:  # Check first 5 lines
-        # First, check for exact matches (case-sensitive)
-        for known in known_senders_exact:
-            if known in line:
-                print(f"[DEBUG] Found exact match for '{known}' in line: {line}")
-                return known
-        
-        # If no exact match, check if OCR might have split or slightly misread the text
-        # Remove spaces to check for split words (like "Sure Pay" -> "SurePay")
-        line_no_spaces = line.replace(' ', '')
-        for known in known_senders_exact:
-            if known in line_no_spaces:
-                print(f"[DEBUG] Found '{known}' after removing spaces from line: {line}")
-                return known
-        
-        # Clean the line for general extraction
-        cleaned = line
-        
-        # Remove common symbols and UI elements (but keep spaces and dashes temporarily)
-        cleaned = re.sub(r'[€<>«»→←↑↓▶◀▲▼■□●○★☆♦♣♠♥…·•@#$%^&*()_+=\[\]{}|\\:;"\',.<>?/~`]', ' ', cleaned)
-        
-        # Remove multiple spaces
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        
-        print(f"[DEBUG] Cleaned line: '{cleaned}'")
-        
-        # Create a version without spaces/dashes for number extraction
-        numbers_only = cleaned.replace(' ', '').replace('-', '')
-        
-        # Check for phone number pattern (0 followed by 9 digits)
-        # This will match: 0110711830, 0110 711830, 0110-711830, etc.
-        phone_match = re.search(r'(0\d{9})', numbers_only)
-        if phone_match:
-            phone_number = phone_match.group(1)
-            print(f"[DEBUG] Found phone number: {phone_number}")
-            return phone_number
-        
-        # Check for short code (4-5 digits only, not part of a longer number)
-        shortcode_match = re.search(r'\b(\d{4,5})\b', cleaned)
-        if shortcode_match:
-            # Make sure it's not part of a phone number
-            shortcode = shortcode_match.group(1)
-            # Verify it's standalone (not followed by more digits)
-            if not re.search(rf'{shortcode}\d', numbers_only):
-                print(f"[DEBUG] Found short code: {shortcode}")
-                return shortcode
-        
-        # Look for text-based sender IDs (preserve case)
-        # Extract words with 4+ characters
-        text_match = re.search(r'\b([A-Za-z]{4,})\b', cleaned)
-        if text_match:
-            sender = text_match.group(1)
-            print(f"[DEBUG] Found text sender: {sender}")
-            return sender
-        
-        # Look for any alphanumeric sequence that could be a sender ID
-        alphanumeric_match = re.search(r'\b([A-Za-z0-9]{3,})\b', cleaned)
-        if alphanumeric_match:
-            sender = alphanumeric_match.group(1)
-            # Only return if it's not purely numeric or if it's a short numeric code
-            if not sender.isdigit() or len(sender) <= 5:
-                print(f"[DEBUG] Found alphanumeric sender: {sender}")
-                return sender
-    
-    # Last resort: return first word from first line if it exists
-    if lines:
-        first_words = lines[0].split()
-        if first_words:
-            # Try to extract phone number from first word
-            first_word_clean = ''.join(first_words).replace(' ', '').replace('-', '')
-            phone_match = re.search(r'(0\d{9})', first_word_clean)
-            if phone_match:
-                result = phone_match.group(1)
-                print(f"[DEBUG] Fallback phone result: {result}")
-                return result
-            
-            result = re.sub(r'[^A-Za-z0-9]', '', first_words[0])
-            if result:
-                print(f"[DEBUG] Fallback result: {result}")
-                return result
-    
-    return None
-        
-       # Clean the line - but preserve spaces and dashes for phone numbers
-    cleaned = line
-        
-        # Remove common symbols and UI elements (but keep spaces and dashes temporarily)
-    cleaned = re.sub(r'[€<>«»→←↑↓▶◀▲▼■□●○★☆♦♣♠♥…·•@#$%^&*()_+=\[\]{}|\\:;"\',.<>?/~`]', ' ', cleaned)
-        
-        # Remove multiple spaces
-    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        
-    print(f"[DEBUG] Cleaned line: '{cleaned}'")
-        
-        # Create a version without spaces/dashes for number extraction
-    numbers_only = cleaned.replace(' ', '').replace('-', '')
-        
-        # Check for phone number pattern (0 followed by 9 digits)
-        # This will match: 0110711830, 0110 711830, 0110-711830, etc.
-    phone_match = re.search(r'(0\d{9})', numbers_only)
-    if phone_match:
-            phone_number = phone_match.group(1)
-            print(f"[DEBUG] Found phone number: {phone_number}")
-            return phone_number
-        
-        # Check for short code (4-5 digits only, not part of a longer number)
-    shortcode_match = re.search(r'\b(\d{4,5})\b', cleaned)
-    if shortcode_match:
-            # Make sure it's not part of a phone number
-            shortcode = shortcode_match.group(1)
-            # Verify it's standalone (not followed by more digits)
-            if not re.search(rf'{shortcode}\d', numbers_only):
-                print(f"[DEBUG] Found short code: {shortcode}")
-                return shortcode
-        
-        # Look for text-based sender IDs (4+ letters)
-    text_match = re.search(r'\b([A-Za-z]{4,})\b', cleaned)
-    if text_match:
-            sender = text_match.group(1)
-            print(f"[DEBUG] Found text sender: {sender}")
-            return sender
-        
-        # Look for any alphanumeric sequence that could be a sender ID
-    alphanumeric_match = re.search(r'\b([A-Za-z0-9]{3,})\b', cleaned)
-    if alphanumeric_match:
-            sender = alphanumeric_match.group(1)
-            # Only return if it's not purely numeric or if it's a short numeric code
-            if not sender.isdigit() or len(sender) <= 5:
-                print(f"[DEBUG] Found alphanumeric sender: {sender}")
-                return sender
-    
-    # Last resort: return first word from first line if it exists
-    if lines:
-        first_words = lines[0].split()
-        if first_words:
-            # Try to extract phone number from first word
-            first_word_clean = ''.join(first_words).replace(' ', '').replace('-', '')
-            phone_match = re.search(r'(0\d{9})', first_word_clean)
-            if phone_match:
-                result = phone_match.group(1)
-                print(f"[DEBUG] Fallback phone result: {result}")
-                return result
-            
-            result = re.sub(r'[^A-Za-z0-9]', '', first_words[0])
-            if result:
-                print(f"[DEBUG] Fallback result: {result}")
-                return result
-    
-    return None
+    """Clean and extract sender ID from OCR text (the best ranked candidate)"""
+    candidates = parse_sender_candidates(raw_text)
+    return candidates[0].sender_id if candidates else None
 
 
-def extract_sender_id(image_path):
+def extract_sender_id(image):
     """Extract and clean sender ID from image using OCR"""
     try:
         _configure_tesseract()
     except RuntimeError as e:
         raise
     
-    # Run cleanup before processing to maintain privacy
-    delete_old_uploads(os.path.join(os.path.dirname(__file__), "uploads"))
-    print(f"[DEBUG] Processing image: {image_path}")
-    
+    logger.debug("Processing image: %s", image)
+
+    return _extract_sender_id_multi_pass(image, _detect_layout(_open_image(image)))[0]
+
+
+def _config_label(config):
+    """Short metric label for a tesseract config, e.g. 'psm7'"""
+    return 'psm' + str(ocr_pool._parse_psm(config))
+
+
+def _layout_key(img, layout=None):
+    """Coarse screenshot layout (orientation and header theme) the OCR strategy learns per"""
+    width, height = img.size
+    aspect = height / width if width else 1.0
+    orientation = 'portrait' if aspect > 1.3 else 'landscape' if aspect < 0.77 else 'square'
+    header = img.crop(_header_box(width, height, layout))
+    if header.mode != 'L':
+        header = header.convert('L')
+    if min(header.size) >= 8:
+        header = header.reduce(4)
+    pixels = np.asarray(header)
+    theme = 'dark' if pixels.size and pixels.mean() < 127 else 'light'
+    return f'{orientation}-{theme}'
+
+
+_NOT_ALNUM = re.compile(r'[^0-9a-z]')
+
+
+def _candidate_confidence(data, sender_id):
+    """Mean confidence of the OCR words that make up sender_id (all words if none match)"""
+    target = _NOT_ALNUM.sub('', sender_id.casefold())
+    matched = []
+    every = []
+    for word, conf in zip(data['text'], data['conf']):
+        conf = float(conf)
+        token = _NOT_ALNUM.sub('', word.casefold())
+        if not token or conf < 0:
+            continue
+        every.append(conf)
+        if token in target or target in token:
+            matched.append(conf)
+    scores = matched or every
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def _extract_sender_id_multi_pass(image, layout=None):
+    """
+    Read the sender ID from the preprocessed header, trying each OCR config.
+    Returns (sender_id, config label that produced it).
+
+    Configs run in the order ocr_strategy learned works best for this layout
+    and stop at the first known sender or at a phone/short code/text candidate
+    whose words were read with at least SENDER_MIN_CONFIDENCE. Otherwise the
+    reading with the best (parser score, confidence) wins. Configs that never
+    win on the layout only run when no other config found a candidate.
+    """
+    img = _open_image(image)
+    layout_key = _layout_key(img, layout)
+    ordered, skipped = ocr_strategy.plan(layout_key, SENDER_OCR_CONFIGS)
+
     # Preprocess the image
-    processed_img = preprocess_image(image_path)
-    
-    # Try multiple OCR configurations for better accuracy
-    configs = [
-        r'--oem 3 --psm 7',  # Single line of text (best for sender ID)
-        r'--oem 3 --psm 6',  # Assume uniform block of text
-        r'--oem 3 --psm 11', # Sparse text
-        r'--oem 3 --psm 13', # Raw line (no layout analysis)
-    ]
+    with timed('preprocess'):
+        processed_img = preprocess_image(image, layout)
     
     best_result = None
+    best_config = None
+    best_rank = None
+    tried = []
     
-    for config in configs:
-        print(f"[DEBUG] Trying OCR with config: {config}")
+    for config in ordered + skipped:
+        if config in skipped and best_result:
+            break
+        logger.debug("Trying OCR with config: %s", config)
+        tried.append(config)
         try:
-            raw_text = pytesseract.image_to_string(processed_img, config=config)
-            sender_id = clean_sender_id(raw_text)
-            
-            if sender_id:
-                # Check if it matches known senders exactly
-                known_senders = ['HELB', 'SurePay', '5122']
-                if sender_id in known_senders:
-                    print(f"[DEBUG] Matched known sender: {sender_id}")
-                    return sender_id
-                
-                # Prefer text-based IDs or short codes
-                if not sender_id.isdigit() or len(sender_id) <= 5:
-                    if not best_result:
-                        best_result = sender_id
-                elif not best_result:
-                    best_result = sender_id
+            with SENDER_OCR_LATENCY.labels(config=_config_label(config)).time():
+                data = ocr_pool.image_to_data(processed_img, config=config)
+            candidates = parse_sender_candidates('\n'.join(_group_words_into_lines(data)[0]))
+            if not candidates:
+                continue
+            candidate = candidates[0]
+
+            # Known senders are exact matches; nothing can beat them
+            if candidate.kind == 'known':
+                logger.debug("Matched known sender: %s", candidate.sender_id)
+                ocr_strategy.record(layout_key, tried, config, early_exit=True)
+                return candidate.sender_id, _config_label(config)
+
+            confidence = _candidate_confidence(data, candidate.sender_id)
+            logger.debug("Candidate %s from %s (confidence %.1f)", candidate, config, confidence)
+            if candidate.kind in SENDER_CONFIDENT_KINDS and confidence >= SENDER_MIN_CONFIDENCE:
+                ocr_strategy.record(layout_key, tried, config, early_exit=True)
+                return candidate.sender_id, _config_label(config)
+            if best_rank is None or (candidate.score, confidence) > best_rank:
+                best_result, best_config, best_rank = candidate.sender_id, config, (candidate.score, confidence)
         except Exception as e:
-            print(f"[DEBUG] OCR attempt failed with config {config}: {str(e)}")
+            logger.warning("OCR attempt failed with config %s: %s", config, e)
             continue
     
-    print(f"[DEBUG] Final extracted sender ID: '{best_result}'")
-    return best_result
+    ocr_strategy.record(layout_key, tried, best_config)
+    logger.debug("Final extracted sender ID: '%s'", best_result)
+    return best_result, (_config_label(best_config) if best_config else None)
+
+
+def _prepare_page(img):
+    """Grayscale and contrast-boost a full screenshot for OCR"""
+    # Convert to grayscale for better OCR
+    if img.mode != 'L':
+        img = img.convert('L')
+
+    # Slight contrast enhancement
+    return ImageEnhance.Contrast(img).enhance(1.8)
+
+
+def _group_words_into_lines(data, box=None):
+    """
+    Rebuild text lines from an image_to_data word table.
+    If `box` is given only words whose centre falls inside it are kept.
+    Returns (lines, confidences) where confidences holds one value per kept word.
+    """
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data['text']):
+        word = word.strip()
+        if not word:
+            continue
+        if box is not None:
+            cx = data['left'][i] + data['width'][i] / 2
+            cy = data['top'][i] + data['height'][i] / 2
+            if not (box[0] <= cx <= box[2] and box[1] <= cy <= box[3]):
+                continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        lines.setdefault(key, []).append(word)
+        conf = float(data['conf'][i])
+        if conf >= 0:
+            confidences.append(conf)
+    return [' '.join(words) for _, words in sorted(lines.items())], confidences
 
-def delete_old_uploads(directory_path, days=1):
+
+def ocr_screenshot(image):
     """
-    Delete images in the uploads folder that are older than `1 day`.
-    Reinforces data privacy by removing old uploaded files.
+    Extract (sender_id, message_text) from a screenshot with a single OCR pass.
+
+    The image is decoded once, cropped to the detected header and message
+    bubbles, and read with one image_to_data call. The sender ID comes from
+    the words inside the header region and the message text from all words.
+    The multi-config header OCR only runs as a fallback when the header
+    words are missing or read with low confidence.
     """
     try:
-        now = time.time()
-        cutoff = now - (days * 86400)  # 86400 seconds in a day.
+        _configure_tesseract()
+    except RuntimeError as e:
+        raise
 
-        if not os.path.exists(directory_path):
-            print(f"[CLEANUP] Directory not found: {directory_path}")
-            return
+    logger.debug("Processing image: %s", image)
 
-        deleted_files = []
-        for filename in os.listdir(directory_path):
-            file_path = os.path.join(directory_path, filename)
-
-            # Only process files
-            if os.path.isfile(file_path):
-                file_mtime = os.path.getmtime(file_path)
-                if file_mtime < cutoff:
-                    os.remove(file_path)
-                    deleted_files.append(filename)
-
-        if deleted_files:
-            print(f"[CLEANUP] Deleted {len(deleted_files)} old files: {deleted_files}")
-        else:
-            print("[CLEANUP] No old uploads to remove.")
-    except Exception as e:
-        print(f"[CLEANUP ERROR] {str(e)}")
+    img = _open_image(image)
+    img.load()
+
+    layout = _detect_layout(img)
+    page, top, scale = _page_region(img, layout)
+
+    with timed('ocr_page'):
+        data = ocr_pool.image_to_data(_prepare_page(page), config=PAGE_OCR_CONFIG)
+
+    message_text = '\n'.join(_group_words_into_lines(data)[0])
+    logger.debug("Full OCR text: %s", message_text)
+
+    left, header_top, right, header_bottom = _header_box(*img.size, layout)
+    box = (left * scale, (header_top - top) * scale, right * scale, (header_bottom - top) * scale)
+    header_lines, confidences = _group_words_into_lines(data, box)
+    candidates = parse_sender_candidates('\n'.join(header_lines))
+    sender_id = candidates[0].sender_id if candidates else None
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    logger.debug("Single-pass sender ID: '%s' (confidence %.1f)", sender_id, confidence)
+
+    source = 'single_pass' if sender_id else 'none'
+    if (not sender_id or candidates[0].kind not in SENDER_CONFIDENT_KINDS
+            or confidence < SENDER_MIN_CONFIDENCE):
+        fallback, config = _extract_sender_id_multi_pass(img, layout)
+        if fallback:
+            sender_id, source = fallback, config
+    SENDER_SOURCE.labels(source=source).inc()
+
+    return sender_id, message_text
 
 # ---------------------------
 # VIRUSTOTAL INTEGRATION
 # ---------------------------
-def extract_message_text(image_path):
+def extract_message_text(image):
     """Extract full message text (not just sender ID) for link analysis"""
     try:
         _configure_tesseract()
     except RuntimeError as e:
         raise
 
-    img = Image.open(image_path)
-    
-    # Convert to grayscale for better OCR
-    if img.mode != 'L':
-        img = img.convert('L')
-
-    # Slight contrast enhancement
-    img = ImageEnhance.Contrast(img).enhance(1.8)
+    img = _open_image(image)
+    img = _prepare_page(_page_region(img, _detect_layout(img))[0])
 
     # Use OCR on the full image
-    config = r'--oem 3 --psm 6'
-    raw_text = pytesseract.image_to_string(img, config=config)
+    with timed('ocr_message_text'):
+        raw_text = ocr_pool.image_to_string(img, config=PAGE_OCR_CONFIG)
 
-    print(f"[DEBUG] Full OCR text: {raw_text}")
+    logger.debug("Full OCR text: %s", raw_text)
 
     return raw_text
 
@@ -396,34 +481,10 @@ def extract_urls_from_text(text):
         r'(https?://[^\s]+|www\.[^\s]+)',
         re.IGNORECASE
     )
-    return re.findall(url_pattern, text)
-
-
-def verify_link_with_virustotal(url):
-    """Check a URL against the VirusTotal API"""
-    if not VT_API_KEY:
-        return {"verdict": "error", "details": "Missing API key"}
-
-    try:
-        headers = {"x-apikey": VT_API_KEY}
-        url_id = base64.urlsafe_b64encode(url.encode()).decode().strip("=")
-        vt_url = f"https://www.virustotal.com/api/v3/urls/{url_id}"
-
-        response = requests.get(vt_url, headers=headers)
-        if response.status_code == 200:
-            result = response.json()
-            stats = result.get("data", {}).get("attributes", {}).get("last_analysis_stats", {})
-            malicious = stats.get("malicious", 0)
-            suspicious = stats.get("suspicious", 0)
-
-            if malicious > 0:
-                return {"verdict": "malicious", "details": f"Flagged by {malicious} security vendors"}
-            elif suspicious > 0:
-                return {"verdict": "suspicious", "details": f"Flagged as suspicious by {suspicious} security vendors"}
-            else:
-                return {"verdict": "clean", "details": "No security vendors flagged this URL"}
-        else:
-            return {"verdict": "error", "details": "API request failed"}
-
-    except Exception as e:
-        return {"verdict": "error", "details": str(e)}
\ No newline at end of file
+    # Drop OCR debris: trailing punctuation, and "www." fragments with no usable host
+    urls = []
+    for match in re.findall(url_pattern, text):
+        url = clean_url(match)
+        if parse_url(url) is not None:
+            urls.append(url)
+    return urls
@@ -0,0 +1,125 @@
+"""
+Result cache for repeated screenshot uploads.
+
+Uploads are keyed by a SHA-256 of their bytes, so only byte-identical
+repeats are served from the cache. Perceptual (near-duplicate) matching is
+deliberately not used: a chat screenshot's downscaled hash is dominated by
+the app layout, so a forward with a different sender ID or link hashes
+within a few bits of the original and would be given the original's sender,
+verdict and link results.
+
+The in-process LRU is a near-cache in front of the shared cache
+(shared_cache.py), which holds results for every worker and host. A miss
+here checks the shared tier before the upload is OCR'd again. invalidate()
+drops cached results everywhere, e.g. when the sender registry changes what
+counts as legitimate.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import shared_cache
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "1024"))
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", str(6 * 3600)))
+
+
+def fingerprint(data):
+    """SHA-256 hex digest of the raw bytes of an upload"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageResultCache:
+    def __init__(self, max_entries=IMAGE_CACHE_SIZE, ttl=IMAGE_CACHE_TTL, store=None):
+        self.max_entries = max_entries
+        # IMAGE_CACHE_SIZE=0 turns result caching off entirely, shared tier included
+        self.store = store if max_entries > 0 else None
+        self.ttl = ttl
+        self._entries = OrderedDict()  # digest -> (result, expires_at)
+        self._lock = threading.Lock()
+        self._counters = {'exact_hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, digest):
+        """Return a copy of the cached result for this upload or None"""
+        if self.store is not None and self.store.sync():
+            self._clear()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[1] < now:
+                del self._entries[digest]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self._counters['exact_hits'] += 1
+                return dict(entry[0])
+
+        shared = self._get_shared(digest)
+        with self._lock:
+            if shared is not None:
+                result, expires_at = shared
+                self._remember(digest, result, expires_at)
+                self._counters['shared_hits'] += 1
+                return dict(result)
+            self._counters['misses'] += 1
+            return None
+
+    def _get_shared(self, digest):
+        """(result, expires_at) for this digest in the shared tier, or None"""
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(digest)
+        except Exception as e:
+            logger.warning("Shared image cache read error: %s", e)
+        return None
+
+    def put(self, digest, result):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(digest, result, expires_at)
+        if self.store is None:
+            return
+        try:
+            self.store.set(digest, result, expires_at)
+        except Exception as e:
+            logger.warning("Shared image cache write error: %s", e)
+
+    def _remember(self, digest, result, expires_at):
+        self._entries.pop(digest, None)
+        self._entries[digest] = (dict(result), expires_at)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def _clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self):
+        """Drop every cached result, in this process and (through the shared tier) all others"""
+        self._clear()
+        if self.store is not None:
+            try:
+                self.store.invalidate()
+            except Exception as e:
+                logger.warning("Shared image cache invalidate error: %s", e)
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self._counters[k] for k in ('exact_hits', 'shared_hits', 'misses'))
+            hits = lookups - self._counters['misses']
+            return {
+                **self._counters,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+image_cache = ImageResultCache(store=shared_cache.namespace('images'))
@@ -0,0 +1,114 @@
+"""
+Ingestion checks and bounded decoding for uploaded screenshots.
+
+Before anything is decoded an upload must be within INGEST_MAX_BYTES, start
+with JPEG or PNG magic bytes, and declare at most INGEST_MAX_PIXELS (JPEG)
+or INGEST_MAX_PNG_PIXELS (PNG) in its header. PNG gets the lower cap
+because it can only be decoded at full size: a highly compressible 7500x7500
+RGBA PNG is a few hundred KB on the wire and over 200 MB once decoded.
+Decoding then targets the resolution OCR needs: images whose long
+side exceeds INGEST_MAX_SIDE are shrunk in the JPEG DCT domain with draft()
+while decoding, and by an integer box reduce() afterwards, so a 50-megapixel
+camera photo never exists in memory at full size. Truncated files are
+rejected instead of being half decoded.
+"""
+import io
+import math
+import os
+
+from PIL import Image
+
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(10 * 1024 * 1024)))
+INGEST_MAX_PIXELS = int(os.getenv("INGEST_MAX_PIXELS", str(60_000_000)))
+# PNG has no reduced-scale decode; 16M pixels still fits any phone or tablet screenshot
+INGEST_MAX_PNG_PIXELS = int(os.getenv("INGEST_MAX_PNG_PIXELS", str(16_000_000)))
+# Long side OCR needs; tall phone screenshots (2400px) are kept as they are
+INGEST_MAX_SIDE = int(os.getenv("INGEST_MAX_SIDE", "2560"))
+INGEST_MIN_SIDE = 16
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+_MAGIC = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+)
+
+
+class UploadRejected(Exception):
+    """Raised for uploads that are too large, not an image or not decodable"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def sniff_format(data):
+    """Return 'JPEG' or 'PNG' from the leading bytes, or None"""
+    head = bytes(data[:8])
+    for magic, image_format in _MAGIC:
+        if head.startswith(magic):
+            return image_format
+    return None
+
+
+def _open_header(data, image_format):
+    """Open an upload lazily (header only) and enforce the pixel limits"""
+    try:
+        img = Image.open(io.BytesIO(data), formats=[image_format])
+    except Exception:
+        raise UploadRejected("Could not read image")
+    width, height = img.size
+    max_pixels = INGEST_MAX_PIXELS if image_format == 'JPEG' else INGEST_MAX_PNG_PIXELS
+    if width * height > max_pixels:
+        raise UploadRejected(f"Image has too many pixels ({width}x{height})", status=413)
+    if min(width, height) < INGEST_MIN_SIDE:
+        raise UploadRejected(f"Image is too small ({width}x{height})")
+    return img
+
+
+def check_upload(data, filename=None):
+    """
+    Validate an upload's size, name, format and dimensions without decoding
+    any pixels; raises UploadRejected, otherwise returns 'JPEG' or 'PNG'.
+    """
+    if not data:
+        raise UploadRejected("Empty upload")
+    if len(data) > INGEST_MAX_BYTES:
+        raise UploadRejected(f"Image too large (limit {INGEST_MAX_BYTES // (1024 * 1024)} MB)", status=413)
+    # Names without an extension (e.g. pasted blobs) are judged by content alone
+    if filename and '.' in filename and not allowed_file(filename):
+        raise UploadRejected("Unsupported file type; upload a PNG or JPEG screenshot")
+    image_format = sniff_format(data)
+    if image_format is None:
+        raise UploadRejected("Unsupported file type; upload a PNG or JPEG screenshot")
+    _open_header(data, image_format)
+    return image_format
+
+
+def decode_upload(data):
+    """Decode upload bytes into a fully loaded PIL image no larger than OCR needs"""
+    image_format = sniff_format(data)
+    if image_format is None:
+        raise UploadRejected("Unsupported file type; upload a PNG or JPEG screenshot")
+    img = _open_header(data, image_format)
+
+    width, height = img.size
+    long_side = max(width, height)
+    if long_side > INGEST_MAX_SIDE and image_format == 'JPEG':
+        # Decode at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients
+        scale = INGEST_MAX_SIDE / long_side
+        img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+
+    try:
+        img.load()
+    except Exception:
+        raise UploadRejected("Image is truncated or corrupt")
+
+    long_side = max(img.size)
+    if long_side > INGEST_MAX_SIDE:
+        img = img.reduce(math.ceil(long_side / INGEST_MAX_SIDE))
+    return img
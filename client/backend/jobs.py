@@ -0,0 +1,159 @@
+"""
+Job queue used by the asynchronous /analyze mode.
+
+Jobs are drained by a small pool of daemon threads in the process that
+accepted them. The queue is bounded so that a burst of uploads is rejected
+early instead of piling up in memory, and finished results are kept for
+`result_ttl` seconds for polling. With a store (the shared cache's 'jobs'
+namespace) every status change is also written there, so a poll that lands
+on another gunicorn worker or host still finds the job.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "50"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "600"))
+
+
+class QueueFull(Exception):
+    """Raised when the job queue already holds `max_pending` jobs"""
+
+
+class JobQueue:
+    def __init__(self, handler, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING,
+                 result_ttl=JOB_RESULT_TTL, store=None):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.store = store
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+    def _start(self):
+        # Threads are started on first use so each (forked) gunicorn worker gets its own
+        alive = [t for t in self._threads if t.is_alive()]
+        for i in range(len(alive), self.workers):
+            thread = threading.Thread(target=self._run, name=f"analyze-job-{i}", daemon=True)
+            thread.start()
+            alive.append(thread)
+        self._threads = alive
+
+    def submit(self, *args):
+        """Queue handler(*args) and return its job id; raises QueueFull under backpressure"""
+        job_id = uuid.uuid4().hex
+        job = {'id': job_id, 'status': 'queued', 'result': None, 'error': None,
+               'submitted_at': time.time(), 'finished_at': None}
+        # Published before it is queued, so it can never overwrite a worker's later update
+        self._publish(dict(job))
+        with self._lock:
+            self._purge_expired()
+            self._start()
+            try:
+                self._queue.put_nowait((job_id, args))
+            except queue.Full:
+                self._counters['rejected'] += 1
+                job = None
+            else:
+                self._jobs[job_id] = job
+                self._counters['submitted'] += 1
+        if job is None:
+            self._unpublish(job_id)
+            raise QueueFull(f"{self.max_pending} analyses already pending")
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of the job or None if it is unknown or expired"""
+        with self._lock:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        # Accepted by another worker or host
+        shared = self._get_shared(job_id)
+        return dict(shared[0]) if shared is not None else None
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job['status'] == 'running')
+            return {
+                'queue_depth': self._queue.qsize(),
+                'running': running,
+                'max_pending': self.max_pending,
+                'workers': self.workers,
+                **self._counters,
+            }
+
+    def _publish(self, job):
+        if self.store is None:
+            return
+        # Unfinished jobs are re-published at every status change, which extends them too
+        expires_at = (job['finished_at'] or time.time()) + self.result_ttl
+        try:
+            self.store.set(job['id'], job, expires_at)
+        except Exception as e:
+            logger.warning("Shared job store write error: %s", e)
+
+    def _unpublish(self, job_id):
+        if self.store is None:
+            return
+        try:
+            self.store.delete(job_id)
+        except Exception as e:
+            logger.warning("Shared job store write error: %s", e)
+
+    def _get_shared(self, job_id):
+        """(job, expires_at) from the shared store, or None"""
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(job_id)
+        except Exception as e:
+            logger.warning("Shared job store read error: %s", e)
+        return None
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] is not None and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job_id, args = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job['status'] = 'running'
+                    snapshot = dict(job)
+            if job is not None:
+                self._publish(snapshot)
+            try:
+                result = self.handler(*args)
+            except Exception as e:
+                with self._lock:
+                    if job is not None:
+                        job.update(status='failed', error=str(e), finished_at=time.time())
+                        snapshot = dict(job)
+                    self._counters['failed'] += 1
+            else:
+                with self._lock:
+                    if job is not None:
+                        job.update(status='done', result=result, finished_at=time.time())
+                        snapshot = dict(job)
+                    self._counters['completed'] += 1
+            finally:
+                self._queue.task_done()
+            if job is not None:
+                self._publish(snapshot)
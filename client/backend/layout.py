@@ -0,0 +1,92 @@
+"""
+Fast layout detection for chat screenshots (SMS, WhatsApp, Gallery views).
+
+A grayscale copy about LAYOUT_SAMPLE_WIDTH pixels wide is reduced to a row
+profile: the number of strong horizontal intensity changes in each row.
+Text rows have many, while blank rows, flat bars and bubble interiors have
+almost none. Runs of text rows form bands. From the bands we locate:
+
+* the status bar (a thin band at the very top, if present), which is skipped
+* the header bar, the first band below it, which holds the sender ID
+* the bottom chrome (navigation bar / reply box), which is skipped
+* the message body, from the header to the last bubble line
+
+and the typical body line height, which tells how far the page can be
+downscaled before OCR without starving tesseract of pixels.
+"""
+import logging
+import os
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_SAMPLE_WIDTH = 256
+# Minimum intensity step (0-255) between neighbouring pixels counted as an edge
+LAYOUT_EDGE_THRESHOLD = 24
+# Edges a row needs to count as text (a bubble border alone gives two)
+LAYOUT_MIN_EDGES = 4
+# Body line height (px) the page is scaled down to before OCR; 0 disables scaling
+LAYOUT_TARGET_LINE_HEIGHT = int(os.getenv("LAYOUT_TARGET_LINE_HEIGHT", "48"))
+
+# Fractions of the screenshot height
+STATUS_BAR_MAX_TOP = 0.03
+STATUS_BAR_MAX_HEIGHT = 0.022
+HEADER_MAX_TOP = 0.15
+BOTTOM_CHROME_RATIO = 0.05
+
+# header/body are (left, top, right, bottom) boxes in full-resolution pixels
+Layout = namedtuple('Layout', ['header', 'body', 'line_height', 'scale'])
+
+
+def _row_bands(gray):
+    """Return [(top, bottom)] runs of text rows in a 2-D uint8 array"""
+    steps = np.abs(np.diff(gray.astype(np.int16), axis=1))
+    text_rows = (steps > LAYOUT_EDGE_THRESHOLD).sum(axis=1) >= LAYOUT_MIN_EDGES
+    # Boundaries of the True runs
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], text_rows.view(np.int8), [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def detect_layout(img):
+    """Return the Layout of a decoded screenshot, or None when no header band is found"""
+    width, height = img.size
+    if width < 2 or height < 2:
+        return None
+
+    sample = img if img.mode == 'L' else img.convert('L')
+    factor = max(1, width // LAYOUT_SAMPLE_WIDTH)
+    if factor > 1:
+        sample = sample.reduce(factor)
+    gray = np.asarray(sample)
+    scale_y = height / gray.shape[0]
+    bands = [(round(top * scale_y), round(bottom * scale_y)) for top, bottom in _row_bands(gray)]
+    if not bands:
+        return None
+
+    # Status bar: thin, flush with the top and clearly smaller than the header below it
+    first = bands[0]
+    if (len(bands) > 1 and first[0] < height * STATUS_BAR_MAX_TOP
+            and first[1] - first[0] < height * STATUS_BAR_MAX_HEIGHT
+            and first[1] - first[0] < 0.6 * (bands[1][1] - bands[1][0])):
+        bands = bands[1:]
+
+    header_top, header_bottom = bands[0]
+    if header_top > height * HEADER_MAX_TOP:
+        return None
+    pad = max(4, (header_bottom - header_top) // 3)
+    header = (0, max(0, header_top - pad), width, min(height, header_bottom + pad))
+
+    body_bands = [b for b in bands[1:] if b[0] < height * (1 - BOTTOM_CHROME_RATIO)] or bands[:1]
+    body = (0, header[1], width, min(height, body_bands[-1][1] + pad))
+
+    # Ignore rules and dots; they are not text lines
+    line_heights = [bottom - top for top, bottom in body_bands if bottom - top >= height * 0.006]
+    line_height = int(np.median(line_heights)) if line_heights else 0
+    scale = 1.0
+    if LAYOUT_TARGET_LINE_HEIGHT and line_height > LAYOUT_TARGET_LINE_HEIGHT:
+        scale = LAYOUT_TARGET_LINE_HEIGHT / line_height
+
+    logger.debug("Layout: header %s, body %s, line height %s, scale %.2f", header, body, line_height, scale)
+    return Layout(header, body, line_height, scale)
@@ -0,0 +1,211 @@
+"""
+Scam scoring for the OCR'd message body.
+
+Runs on the text the OCR pass already produced, so it never starts another
+tesseract run and makes no network calls. One logistic model combines:
+
+- lure automata: one precompiled regex per kind of lure (fees, prizes,
+  urgency, ...), each searched on its own so one lure's match never hides
+  another's. Matches are model features and are returned so the verdict
+  can say why a message looks like a scam.
+- hashed n-grams: word unigrams and bigrams, numbers folded to "0",
+  hashed into a fixed number of buckets.
+
+The weights are in db/message_model.json and are loaded once per process.
+Retrain them from db/message_samples.jsonl (one {"label": 0 or 1, "text"}
+per line) with
+
+    python message_classifier.py train [samples.jsonl]
+"""
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import zlib
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+MESSAGE_MODEL_PATH = os.getenv("MESSAGE_MODEL_PATH", os.path.join(BASE_DIR, 'db', 'message_model.json'))
+MESSAGE_SAMPLES_PATH = os.path.join(BASE_DIR, 'db', 'message_samples.jsonl')
+# Score from which the message text alone marks a message as a scam
+MESSAGE_SCAM_THRESHOLD = float(os.getenv("MESSAGE_SCAM_THRESHOLD", "0.7"))
+
+MODEL_BUCKETS = 2 ** 16
+TRAIN_EPOCHS = 100
+TRAIN_RATE = 0.1
+TRAIN_L2 = 1e-4
+
+LURES = {
+    'fee': [
+        r'\b(?:processing|registration|activation|validation|verification|handling|service|clearance|approval)'
+        r'\s+(?:fee|charge)s?\b',
+        r'\bmoney goes to\b',
+        r'\bto (?:validate|confirm|activate|verify|process|unlock|release|receive)\b[^.\n]{0,80}'
+        r'\b(?:send|pay|deposit)\b',
+        r'\b(?:send|pay|deposit|transfer)\s+(?:kes|kshs?|sh)\.?\s?\d',
+    ],
+    'urgency': [
+        r'\burgent(?:ly)?\b', r'\bimmediately\b', r'\bwithin \d+\s*(?:hours?|hrs|minutes?|mins)\b',
+        r'\blast chance\b', r'\bfinal notice\b', r'\bexpires? (?:today|tonight|soon)\b', r'\bby tonight\b',
+        r'\bbefore midnight\b', r'\bfailure to\b', r'\bwill be (?:cancelled|forfeited|blocked|suspended|lost)\b',
+        r'\bharaka\b',
+    ],
+    'prize': [
+        r'\bcongratulations?\b', r'\bbravo\b', r'\byou (?:have )?won\b', r'\bwinner\b', r'\bjackpot\b',
+        r'\bumeshinda\b', r'\bzawadi\b', r'\bzinakuja kwako\b', r'\bku-?claim\b', r'\bclaim (?:your|it)\b',
+        r'\bwin yako\b',
+    ],
+    'credential': [
+        r'\b(?:share|send|give|reply with)\b[^.\n]{0,40}\b(?:pin|password|otp|code)\b',
+        r'\b(?:verify|confirm|update) your (?:details|account|mobile|identity)\b',
+    ],
+    'loan_offer': [
+        r'\bneed (?:money|cash|a loan)\b', r'\bno collateral\b', r'\binstant (?:loan|cash)\b',
+        r'\bloan limit\b', r'\bapply\b[^.\n]{0,40}\bin \d+ ?min', r'\bqualif(?:y|ied) for\b[^.\n]{0,30}\bloan\b',
+    ],
+    'personal_number': [
+        r'\b(?:send|pay|call|whatsapp|contact|nirudishie)\b[^.\n]{0,60}(?:\+?254|\b0)[17]\d{2}\s?\d{3}\s?\d{3}\b',
+    ],
+    'betting': [r'\bbonyeza\b', r'\b18\+', r'\bbet(?:ting)?\b'],
+}
+
+LURE_DESCRIPTIONS = {
+    'fee': 'asks for a fee or payment',
+    'urgency': 'pressures you with a deadline or threat',
+    'prize': 'promises a prize or windfall',
+    'credential': 'asks you to confirm details, a PIN or a code',
+    'loan_offer': 'offers easy money',
+    'personal_number': 'asks you to pay or call a personal phone number',
+    'betting': 'pushes betting or a USSD game',
+}
+
+_LURE_PATTERNS = [(name, re.compile('|'.join(patterns), re.IGNORECASE)) for name, patterns in LURES.items()]
+_NUMBER = re.compile(r'\d+')
+_TOKEN = re.compile(r'[a-z0-9*#+]+')
+
+MessageScore = namedtuple('MessageScore', ['scam_score', 'lures'])
+
+
+def find_lures(text):
+    """Names of the LURES found in text, in LURES order"""
+    return [name for name, pattern in _LURE_PATTERNS if pattern.search(text)]
+
+
+def _features(text, lures):
+    tokens = _TOKEN.findall(_NUMBER.sub('0', text.casefold()))
+    features = [f'w:{token}' for token in tokens]
+    features += [f'b:{a} {b}' for a, b in zip(tokens, tokens[1:])]
+    features += [f'lure:{name}' for name in lures]
+    return features
+
+
+def _indices(text, lures, buckets):
+    # Binary features: a screenshot showing the same message twice scores like one copy
+    return {zlib.crc32(feature.encode()) % buckets for feature in _features(text, lures)}
+
+
+def _sigmoid(z):
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1 / (1 + math.exp(-z))
+
+
+class MessageClassifier:
+    def __init__(self, weights, bias, buckets=MODEL_BUCKETS):
+        self.weights = weights  # bucket -> weight, zero weights omitted
+        self.bias = bias
+        self.buckets = buckets
+
+    @classmethod
+    def load(cls, path=MESSAGE_MODEL_PATH):
+        """Load the model file, or return None (message scoring disabled) if it is missing"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            weights = {int(bucket): weight for bucket, weight in data['weights'].items()}
+            return cls(weights, data['bias'], data['buckets'])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Message model not loaded (%s); message scoring disabled", e)
+            return None
+
+    def save(self, path=MESSAGE_MODEL_PATH, **info):
+        data = {'buckets': self.buckets, 'bias': round(self.bias, 6), **info,
+                'weights': {str(bucket): round(weight, 6) for bucket, weight in sorted(self.weights.items())
+                            if abs(weight) >= 1e-4}}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+            f.write('\n')
+
+    def _logit(self, indices):
+        weights = self.weights
+        return self.bias + sum(weights.get(index, 0.0) for index in indices)
+
+    def score(self, text):
+        """MessageScore(scam probability, lures found) for a message text"""
+        if not text or not text.strip():
+            return MessageScore(0.0, [])
+        lures = find_lures(text)
+        return MessageScore(round(_sigmoid(self._logit(_indices(text, lures, self.buckets))), 4), lures)
+
+
+def train(samples, buckets=MODEL_BUCKETS, epochs=TRAIN_EPOCHS, rate=TRAIN_RATE, l2=TRAIN_L2):
+    """Fit a MessageClassifier on [(text, label)] with L2-regularised logistic SGD"""
+    data = [(_indices(text, find_lures(text), buckets), label) for text, label in samples]
+    model = MessageClassifier({}, 0.0, buckets)
+    rng = random.Random(0)
+    for _ in range(epochs):
+        rng.shuffle(data)
+        for indices, label in data:
+            gradient = _sigmoid(model._logit(indices)) - label
+            model.bias -= rate * gradient
+            for index in indices:
+                weight = model.weights.get(index, 0.0)
+                model.weights[index] = weight - rate * (gradient + l2 * weight)
+    return model
+
+
+def load_samples(path=MESSAGE_SAMPLES_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(entry['text'], int(entry['label'])) for entry in map(json.loads, f) if entry.get('text')]
+
+
+def cross_validate(samples, folds=5):
+    """Accuracy of models trained without each fold, on that fold"""
+    shuffled = list(samples)
+    random.Random(1).shuffle(shuffled)
+    correct = 0
+    for fold in range(folds):
+        held_out = shuffled[fold::folds]
+        model = train([s for i, s in enumerate(shuffled) if i % folds != fold])
+        correct += sum((model.score(text).scam_score >= MESSAGE_SCAM_THRESHOLD) == bool(label)
+                       for text, label in held_out)
+    return correct / len(shuffled)
+
+
+classifier = MessageClassifier.load()
+
+
+def score_message(text):
+    """MessageScore for OCR'd message text, or None when no model is loaded"""
+    return classifier.score(text) if classifier is not None else None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('train', 'score'):
+        sys.exit("usage: python message_classifier.py train [samples.jsonl] | score TEXT")
+    if sys.argv[1] == 'score':
+        print(score_message(' '.join(sys.argv[2:])))
+        sys.exit(0)
+    samples = load_samples(sys.argv[2] if len(sys.argv) > 2 else MESSAGE_SAMPLES_PATH)
+    print(f"{len(samples)} samples, {sum(label for _, label in samples)} scams; "
+          f"5-fold accuracy {cross_validate(samples):.3f}")
+    model = train(samples)
+    model.save(samples=len(samples))
+    print(f"Model written to {MESSAGE_MODEL_PATH} ({len(model.weights)} weights)")
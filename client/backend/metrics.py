@@ -0,0 +1,112 @@
+"""
+Instrumentation for the analyze pipeline: Prometheus metrics and logging setup.
+
+Each pipeline stage is timed with `timed(stage)` into one latency histogram,
+the OCR config that produced each sender ID is counted, and the stats() of
+the caches and job queue are exported as gauges at scrape time. Logging is
+leveled (LOG_LEVEL) and DEBUG records can be sampled (LOG_DEBUG_SAMPLE_RATE)
+so verbose OCR traces stay affordable on the hot path.
+"""
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram,
+                               REGISTRY, generate_latest)
+from prometheus_client.core import GaugeMetricFamily
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_LATENCY = Histogram(
+    'helbme_stage_duration_seconds', 'Latency of each analyze pipeline stage',
+    ['stage'], buckets=_BUCKETS,
+)
+SENDER_OCR_LATENCY = Histogram(
+    'helbme_sender_ocr_duration_seconds', 'Latency of each header OCR config tried',
+    ['config'], buckets=_BUCKETS,
+)
+SENDER_SOURCE = Counter(
+    'helbme_sender_source_total', 'OCR pass that produced the reported sender ID',
+    ['source'],
+)
+ANALYSES = Counter(
+    'helbme_analyses_total', 'Analysed screenshots by endpoint and outcome',
+    ['endpoint', 'outcome'],
+)
+
+
+@contextmanager
+def timed(stage):
+    """Record the duration of the enclosed block under `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+class StatsCollector:
+    """Exports the numeric values of `stats()` dicts as gauges when scraped"""
+
+    def __init__(self):
+        self._sources = {}
+
+    def add(self, name, stats_fn):
+        self._sources[name] = stats_fn
+
+    def collect(self):
+        for name, stats_fn in self._sources.items():
+            try:
+                stats = stats_fn()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield GaugeMetricFamily(f'helbme_{name}_{key}', f'{name} {key}', value=value)
+
+
+_stats_collector = StatsCollector()
+REGISTRY.register(_stats_collector)
+
+
+def register_stats(name, stats_fn):
+    """Expose a component's stats() (cache hit ratios, queue depth, ...) on /metrics"""
+    _stats_collector.add(name, stats_fn)
+
+
+def render_metrics():
+    """Return (body, content type) for the /metrics endpoint"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Aggregate the histograms and counters of every gunicorn worker
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class DebugSampler(logging.Filter):
+    """Let through only a fraction of DEBUG records; other levels always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+    if LOG_DEBUG_SAMPLE_RATE < 1.0:
+        handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE_RATE))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
@@ -0,0 +1,196 @@
+"""
+Pool of long-lived Tesseract engines shared by the OCR helpers.
+
+When tesserocr (the libtesseract binding) is installed each worker keeps a
+PyTessBaseAPI handle with the language model loaded, and images are handed
+over as in-memory buffers. Without tesserocr, or when its engine cannot
+start (e.g. no traineddata under TESSDATA_PREFIX), the helpers fall back to
+pytesseract, which runs the tesseract binary once per call.
+"""
+import logging
+import os
+import queue
+import re
+import threading
+from contextlib import contextmanager
+
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:  # in requirements.txt, but the pytesseract fallback works without it
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", "2"))
+OCR_POOL_MAX_JOBS = int(os.getenv("OCR_POOL_MAX_JOBS", "500"))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+# Column order of tesseract's TSV output (same keys pytesseract.image_to_data returns)
+_TSV_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                'left', 'top', 'width', 'height', 'conf', 'text']
+
+_PSM_PATTERN = re.compile(r'--psm\s+(\d+)')
+
+
+def _parse_psm(config):
+    """Return the page segmentation mode from a tesseract config string"""
+    match = _PSM_PATTERN.search(config or '')
+    return int(match.group(1)) if match else 3
+
+
+def _parse_tsv(tsv):
+    """Parse tesseract TSV text into the dict layout of pytesseract's Output.DICT"""
+    data = {column: [] for column in _TSV_COLUMNS}
+    for row in tsv.splitlines():
+        fields = row.split('\t')
+        if len(fields) < 11:
+            continue
+        if len(fields) == 11:
+            fields.append('')
+        for column, value in zip(_TSV_COLUMNS[:10], fields[:10]):
+            data[column].append(int(value))
+        data['conf'].append(float(fields[10]))
+        data['text'].append(fields[11])
+    return data
+
+
+class OCRWorker:
+    """A single Tesseract engine handle, recycled after `max_jobs` images"""
+
+    def __init__(self, lang=OCR_LANG, max_jobs=OCR_POOL_MAX_JOBS):
+        self.lang = lang
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.api = None
+
+    def _ensure_api(self):
+        if self.api is None:
+            self.api = tesserocr.PyTessBaseAPI(lang=self.lang, oem=tesserocr.OEM.DEFAULT)
+            self.jobs = 0
+
+    def _recognize(self, img, config):
+        self._ensure_api()
+        self.api.SetPageSegMode(_parse_psm(config))
+        self.api.SetImage(img)
+        self.api.Recognize()
+        self.jobs += 1
+
+    def image_to_string(self, img, config=''):
+        self._recognize(img, config)
+        return self.api.GetUTF8Text()
+
+    def image_to_data(self, img, config=''):
+        self._recognize(img, config)
+        return _parse_tsv(self.api.GetTSVText(0))
+
+    def recycle_if_needed(self):
+        """Drop the engine once it has served max_jobs images to bound memory growth"""
+        if self.api is not None and self.jobs >= self.max_jobs:
+            self.close()
+
+    def close(self):
+        if self.api is not None:
+            self.api.End()
+            self.api = None
+
+
+class OCRPool:
+    """Fixed-size pool of OCRWorker handles checked out one request at a time"""
+
+    def __init__(self, size=OCR_POOL_SIZE, lang=OCR_LANG, max_jobs=OCR_POOL_MAX_JOBS):
+        self.size = max(1, size)
+        self._workers = queue.Queue()
+        for _ in range(self.size):
+            self._workers.put(OCRWorker(lang=lang, max_jobs=max_jobs))
+
+    @contextmanager
+    def worker(self):
+        worker = self._workers.get()
+        try:
+            yield worker
+        finally:
+            worker.recycle_if_needed()
+            self._workers.put(worker)
+
+    def warm_up(self):
+        """Load the language model in every worker so the first request is not slow"""
+        workers = [self._workers.get() for _ in range(self.size)]
+        try:
+            blank = Image.new('L', (64, 32), 255)
+            for worker in workers:
+                worker.image_to_string(blank)
+        finally:
+            for worker in workers:
+                self._workers.put(worker)
+
+    def close(self):
+        workers = [self._workers.get() for _ in range(self.size)]
+        for worker in workers:
+            worker.close()
+            self._workers.put(worker)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _start_pool():
+    """A new OCRPool, or None if tesserocr cannot start an engine in this environment"""
+    pool = OCRPool()
+    try:
+        # Fails fast on a missing or wrong tessdata path instead of on every OCR call
+        with pool.worker() as worker:
+            worker._ensure_api()
+    except RuntimeError as e:
+        logger.error("tesserocr could not start (%s); falling back to pytesseract", e)
+        return None
+    return pool
+
+
+def get_pool():
+    """Return the process-wide pool, or None when tesserocr is missing or cannot start"""
+    global _pool, _pool_pid
+    if tesserocr is None:
+        return None
+    # Engine handles are never shared with a forked child; it builds its own pool
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = _start_pool()
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def engine():
+    """'tesserocr' or 'pytesseract': the OCR backend this process uses (or will, once started)"""
+    if tesserocr is None or (_pool_pid == os.getpid() and _pool is None):
+        return 'pytesseract'
+    return 'tesserocr'
+
+
+def warm_up():
+    """Start the pool for this process; a no-op when falling back to pytesseract"""
+    pool = get_pool()
+    if pool is not None:
+        pool.warm_up()
+        logger.info("OCR pool ready with %s tesserocr workers", pool.size)
+
+
+def image_to_string(img, config=''):
+    pool = get_pool()
+    if pool is None:
+        return pytesseract.image_to_string(img, config=config)
+    with pool.worker() as worker:
+        return worker.image_to_string(img, config)
+
+
+def image_to_data(img, config=''):
+    pool = get_pool()
+    if pool is None:
+        return pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT)
+    with pool.worker() as worker:
+        return worker.image_to_data(img, config)
@@ -0,0 +1,163 @@
+"""
+Adaptive ordering of the header OCR configs.
+
+For every screenshot layout (see helpers._layout_key) the strategy counts how
+often each tesseract config was tried and how often it produced the sender ID
+that was finally reported. Configs are tried best-first by their smoothed
+success rate, and a config that has never won after OCR_STRATEGY_MIN_TRIALS
+attempts on a layout is skipped (it only runs when nothing else found a
+candidate).
+
+Counts are learned online in memory and flushed as deltas to a SQLite file
+every OCR_STRATEGY_FLUSH_INTERVAL seconds, so they survive restarts and all
+workers on the host learn from each other.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+
+OCR_STRATEGY_DB = os.getenv("OCR_STRATEGY_DB", os.path.join(BASE_DIR, 'db', 'ocr_strategy.sqlite3'))
+OCR_STRATEGY_MIN_TRIALS = int(os.getenv("OCR_STRATEGY_MIN_TRIALS", "25"))
+OCR_STRATEGY_FLUSH_INTERVAL = float(os.getenv("OCR_STRATEGY_FLUSH_INTERVAL", "30"))
+
+
+class StrategyStore:
+    """Persistent (layout, config) -> (trials, wins) counters"""
+
+    def __init__(self, path=OCR_STRATEGY_DB):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Never reuse a connection inherited across a fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS config_stats (layout TEXT NOT NULL, config TEXT NOT NULL, '
+                'trials INTEGER NOT NULL, wins INTEGER NOT NULL, PRIMARY KEY (layout, config))'
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def add(self, deltas):
+        """Add {(layout, config): [trials, wins]} to the stored counts"""
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                'INSERT INTO config_stats (layout, config, trials, wins) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (layout, config) DO UPDATE SET '
+                'trials = trials + excluded.trials, wins = wins + excluded.wins',
+                [(layout, config, trials, wins) for (layout, config), (trials, wins) in deltas.items()],
+            )
+            conn.commit()
+
+    def load(self):
+        with self._lock:
+            rows = self._connection().execute('SELECT layout, config, trials, wins FROM config_stats')
+            return {(layout, config): [trials, wins] for layout, config, trials, wins in rows}
+
+
+class OCRStrategy:
+    def __init__(self, store=None, min_trials=OCR_STRATEGY_MIN_TRIALS,
+                 flush_interval=OCR_STRATEGY_FLUSH_INTERVAL):
+        self.store = store
+        self.min_trials = min_trials
+        self.flush_interval = flush_interval
+        self._counts = {}   # (layout, config) -> [trials, wins], persisted + local
+        self._pending = {}  # local deltas not yet written to the store
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._counters = {'early_exits': 0, 'configs_run': 0, 'configs_skipped': 0}
+        self._load()
+
+    def _load(self):
+        if self.store is None:
+            return
+        try:
+            counts = self.store.load()
+        except Exception as e:
+            logger.warning("OCR strategy load error: %s", e)
+            return
+        with self._lock:
+            # Local deltas are not in the store yet; keep them on top of its totals
+            for key, (trials, wins) in self._pending.items():
+                entry = counts.setdefault(key, [0, 0])
+                entry[0] += trials
+                entry[1] += wins
+            self._counts = counts
+
+    def plan(self, layout, configs):
+        """
+        Split configs into (ordered, skipped) for this layout. Ordered configs are
+        best-first by (wins + 1) / (trials + 2); ties keep the configured order.
+        """
+        with self._lock:
+            scored = []
+            skipped = []
+            for position, config in enumerate(configs):
+                trials, wins = self._counts.get((layout, config), (0, 0))
+                if trials >= self.min_trials and wins == 0:
+                    skipped.append(config)
+                else:
+                    scored.append((-(wins + 1) / (trials + 2), position, config))
+            if not scored:
+                return list(configs), []
+            self._counters['configs_skipped'] += len(skipped)
+        return [config for _, _, config in sorted(scored)], skipped
+
+    def record(self, layout, tried, winner=None, early_exit=False):
+        """Count one sender ID read: every config in `tried` ran, `winner` produced the result"""
+        with self._lock:
+            for config in tried:
+                for table in (self._counts, self._pending):
+                    entry = table.setdefault((layout, config), [0, 0])
+                    entry[0] += 1
+                    entry[1] += config == winner
+            self._counters['configs_run'] += len(tried)
+            self._counters['early_exits'] += early_exit
+            due = time.monotonic() - self._flushed_at > self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write local deltas to the store and pick up what other workers learned"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if self.store is None:
+            return
+        if pending:
+            try:
+                self.store.add(pending)
+            except Exception as e:
+                logger.warning("OCR strategy write error: %s", e)
+                with self._lock:
+                    for key, (trials, wins) in pending.items():
+                        entry = self._pending.setdefault(key, [0, 0])
+                        entry[0] += trials
+                        entry[1] += wins
+                return
+        self._load()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                'layouts': len({layout for layout, _ in self._counts}),
+                'pending_updates': len(self._pending),
+            }
+
+
+strategy = OCRStrategy(StrategyStore())
+atexit.register(strategy.flush)
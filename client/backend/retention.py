@@ -0,0 +1,193 @@
+"""
+Retention for uploads persisted with PERSIST_UPLOADS.
+
+Uploads are written into hourly bucket directories (uploads/YYYYMMDDTHH/).
+A background sweeper thread deletes whole buckets once they are older than
+UPLOAD_RETENTION_HOURS, and evicts the oldest buckets while the total size
+exceeds UPLOAD_MAX_BYTES. A sweep lists only the bucket names and re-stats
+only the bucket still being written to, so its cost does not grow with the
+number of stored files, and nothing runs on the request path.
+
+Files directly inside uploads/ (the bundled sample screenshots) are never
+touched. Every worker starts its own sweeper from startup.init_worker(),
+never the preloading gunicorn master, so no fork can copy a sweep's held
+lock into a worker. Deletes are idempotent, so workers racing on the same
+bucket is harmless.
+
+Run `python retention.py` to sweep once, e.g. from cron.
+"""
+import calendar
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+
+UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
+# Uploads are analysed in memory; set PERSIST_UPLOADS=1 to also keep a copy on disk
+PERSIST_UPLOADS = os.getenv('PERSIST_UPLOADS', '').lower() in ('1', 'true', 'yes')
+UPLOAD_RETENTION_HOURS = int(os.getenv("UPLOAD_RETENTION_HOURS", "24"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(500 * 1024 * 1024)))
+UPLOAD_SWEEP_INTERVAL = float(os.getenv("UPLOAD_SWEEP_INTERVAL", "300"))
+
+BUCKET_FORMAT = '%Y%m%dT%H'
+_BUCKET_PATTERN = re.compile(r'^\d{8}T\d{2}$')
+
+
+def _bucket_name(timestamp):
+    return time.strftime(BUCKET_FORMAT, time.gmtime(timestamp))
+
+
+def _bucket_start(name):
+    return calendar.timegm(time.strptime(name, BUCKET_FORMAT))
+
+
+def _directory_size(path):
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        return 0
+    return total
+
+
+class UploadStore:
+    def __init__(self, directory=UPLOAD_DIR, retention_hours=UPLOAD_RETENTION_HOURS,
+                 max_bytes=UPLOAD_MAX_BYTES, sweep_interval=UPLOAD_SWEEP_INTERVAL):
+        self.directory = directory
+        self.retention = retention_hours * 3600
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._sizes = {}  # closed bucket -> bytes; they no longer change
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._counters = {'files_written': 0, 'bytes_written': 0, 'sweeps': 0,
+                          'buckets_expired': 0, 'buckets_evicted': 0, 'bytes_deleted': 0}
+        self._last = {'buckets': 0, 'bytes_stored': 0, 'last_sweep_seconds': 0.0}
+
+    def save(self, data, filename):
+        """Write an upload into the current bucket and return its path"""
+        self.start()
+        bucket = os.path.join(self.directory, _bucket_name(time.time()))
+        os.makedirs(bucket, exist_ok=True)
+        name = secure_filename(filename or '') or 'upload.jpg'
+        # Unique prefix so concurrent uploads of "image.jpg" do not overwrite each other
+        path = os.path.join(bucket, f"{uuid.uuid4().hex[:12]}_{name}")
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self._counters['files_written'] += 1
+            self._counters['bytes_written'] += len(data)
+        return path
+
+    def start(self):
+        """Start this process's sweeper thread (again after a fork)"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='upload-retention', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("Upload retention sweep failed: %s", e)
+            time.sleep(self.sweep_interval)
+
+    def _buckets(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                return sorted(e.name for e in entries
+                              if _BUCKET_PATTERN.match(e.name) and e.is_dir(follow_symlinks=False))
+        except FileNotFoundError:
+            return []
+
+    def _delete(self, name):
+        path = os.path.join(self.directory, name)
+        size = self._sizes.pop(name, None)
+        if size is None:
+            size = _directory_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        return size
+
+    def sweep(self):
+        """Delete expired buckets, then the oldest ones while over the size cap"""
+        started = time.perf_counter()
+        now = time.time()
+        current = _bucket_name(now)
+        expired = evicted = freed = 0
+
+        with self._lock:
+            buckets = self._buckets()
+            live = []
+            for name in buckets:
+                if _bucket_start(name) + 3600 <= now - self.retention:
+                    freed += self._delete(name)
+                    expired += 1
+                else:
+                    live.append(name)
+
+            # Closed buckets are sized once; only the open one is re-scanned
+            sizes = {}
+            for name in live:
+                if name == current:
+                    sizes[name] = _directory_size(os.path.join(self.directory, name))
+                else:
+                    if name not in self._sizes:
+                        self._sizes[name] = _directory_size(os.path.join(self.directory, name))
+                    sizes[name] = self._sizes[name]
+            for name in set(self._sizes) - set(live):
+                del self._sizes[name]  # removed by another worker
+
+            total = sum(sizes.values())
+            while live and total > self.max_bytes:
+                name = live.pop(0)
+                total -= sizes[name]
+                freed += self._delete(name)
+                evicted += 1
+
+            self._counters['sweeps'] += 1
+            self._counters['buckets_expired'] += expired
+            self._counters['buckets_evicted'] += evicted
+            self._counters['bytes_deleted'] += freed
+            self._last = {'buckets': len(live), 'bytes_stored': total,
+                          'last_sweep_seconds': round(time.perf_counter() - started, 4)}
+
+        if expired or evicted:
+            logger.info("Upload retention removed %s expired and %s over-quota buckets (%s bytes)",
+                        expired, evicted, freed)
+        return expired, evicted
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, **self._last, 'max_bytes': self.max_bytes,
+                    'retention_hours': self.retention // 3600}
+
+
+upload_store = UploadStore()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    upload_store.sweep()
+    print(upload_store.stats())
@@ -0,0 +1,126 @@
+"""
+Sender ID parser for OCR'd header text.
+
+Each of the first few lines is cleaned once with precompiled patterns and
+classified into candidates: an official sender from the registry, a phone
+number, a short code, a text sender ID or a generic alphanumeric token.
+Candidates are returned ranked by score, which combines how trustworthy the
+kind is with how far down the header the line was, so callers (and the OCR
+strategy) can compare readings instead of taking the first hit.
+"""
+import logging
+import re
+from collections import namedtuple
+
+from sender_registry import registry as sender_registry
+
+logger = logging.getLogger(__name__)
+
+MAX_LINES = 5
+
+# Base score per candidate kind; each line further down the header costs LINE_PENALTY
+KIND_SCORES = {
+    'known': 200,
+    'phone': 80,
+    'shortcode': 70,
+    'alpha': 60,
+    'alnum': 40,
+    'fallback': 10,
+}
+LINE_PENALTY = 25
+
+# Common symbols and UI glyphs; '_' and '-' are kept so IDs like "TIFI_Slice" survive
+_SYMBOLS = re.compile(r'(?:[€<>«»→←↑↓▶◀▲▼■□●○★☆♦♣♠♥…·•@#$%^&*()+=\[\]{}|\\:;"\',.?/~`]|\s)+')
+_DIGIT = re.compile(r'\d')
+_SEPARATORS = re.compile(r'[\s\-_]')
+_PHONE = re.compile(r'0\d{9}')
+_SHORTCODE = re.compile(r'\b\d{4,5}\b')
+_DIGIT_RUN = re.compile(r'\d+')
+_ALPHA = re.compile(r'(?<![A-Za-z0-9])[A-Za-z]{4,}(?:[_\-][A-Za-z0-9]+)*(?![A-Za-z0-9])')
+_ALNUM = re.compile(r'(?<![A-Za-z0-9])[A-Za-z0-9]{3,}(?![A-Za-z0-9])')
+_NON_ALNUM = re.compile(r'[^A-Za-z0-9]')
+
+SenderCandidate = namedtuple('SenderCandidate', ['sender_id', 'kind', 'score', 'line'])
+
+
+def _standalone_shortcode(code, digits):
+    """True unless `code` appears followed by another digit (i.e. inside a longer number)"""
+    for run in _DIGIT_RUN.findall(digits):
+        position = run.find(code)
+        if position != -1 and position + len(code) < len(run):
+            return False
+    return True
+
+
+def _line_candidates(line, known_only=False):
+    """Yield (kind, sender_id) for every reading of one header line, best kind first"""
+    known = sender_registry.find_in(line)
+    if known:
+        yield 'known', known
+    else:
+        # OCR often splits IDs ("Sure Pay" -> "SurePay")
+        known = sender_registry.find_in(line.replace(' ', ''))
+        if known:
+            yield 'known', known
+
+    if known_only:
+        return
+
+    cleaned = _SYMBOLS.sub(' ', line).strip()
+    if _DIGIT.search(cleaned):
+        digits = _SEPARATORS.sub('', cleaned)
+
+        # 0 followed by 9 digits, also when OCR split it ("0110 711830", "0110-711830")
+        phone = _PHONE.search(digits)
+        if phone:
+            yield 'phone', phone.group(0)
+
+        for match in _SHORTCODE.finditer(cleaned):
+            if _standalone_shortcode(match.group(0), digits):
+                yield 'shortcode', match.group(0)
+                break
+
+    alpha = _ALPHA.search(cleaned)
+    if alpha:
+        yield 'alpha', alpha.group(0)
+
+    for match in _ALNUM.finditer(cleaned):
+        token = match.group(0)
+        # Long pure numbers are phone fragments, not sender IDs
+        if not token.isdigit() or len(token) <= 5:
+            yield 'alnum', token
+            break
+
+
+def parse_sender_candidates(raw_text, max_lines=MAX_LINES):
+    """Return SenderCandidates for OCR'd header text, best first (empty if none)"""
+    if not raw_text:
+        return []
+    lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    best = {}
+    top_score = None
+    for index, line in enumerate(lines[:max_lines]):
+        # Once only an official ID could outrank the best candidate, skip the rest of the scan
+        known_only = top_score is not None and top_score >= KIND_SCORES['phone'] - LINE_PENALTY * index
+        for kind, sender_id in _line_candidates(line, known_only):
+            score = KIND_SCORES[kind] - LINE_PENALTY * index
+            if sender_id not in best or best[sender_id].score < score:
+                best[sender_id] = SenderCandidate(sender_id, kind, score, index)
+            if top_score is None or score > top_score:
+                top_score = score
+
+    if not best:
+        # Last resort: the first word of the first line
+        first_words = lines[0].split()
+        if first_words:
+            phone = _PHONE.search(''.join(first_words).replace('-', ''))
+            fallback = phone.group(0) if phone else _NON_ALNUM.sub('', first_words[0])
+            if fallback:
+                best[fallback] = SenderCandidate(fallback, 'fallback', KIND_SCORES['fallback'], 0)
+
+    candidates = sorted(best.values(), key=lambda c: -c.score)
+    logger.debug("Sender candidates: %s", candidates)
+    return candidates
@@ -0,0 +1,213 @@
+"""
+Registry of official HELB sender IDs.
+
+The IDs are loaded once from MongoDB (when connected) or the bundled
+db/sender_ids.json into a frozenset and a single precompiled regex, and
+are reloaded in the background of normal lookups when the source changes.
+Workers that read MongoDB publish the list to the shared cache, so workers
+and hosts that cannot reach MongoDB (yet) use the same list instead of the
+bundled file. Listeners added with on_change() run when the IDs change.
+
+It also keeps a deletion-neighbourhood index of the normalised IDs so
+look-alike senders such as "HE1B", "Helb" or "SurePey" can be flagged as
+spoofs with a bounded edit-distance check.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import shared_cache
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+SENDER_IDS_PATH = os.path.join(BASE_DIR, 'db', 'sender_ids.json')
+SENDER_RELOAD_INTERVAL = float(os.getenv("SENDER_RELOAD_INTERVAL", "30"))
+# How long a published list outlives the last worker that read it from MongoDB
+SENDER_SNAPSHOT_TTL = 86400
+
+# Characters OCR and scammers commonly swap for one another
+_HOMOGLYPHS = str.maketrans({
+    '0': 'o', '1': 'l', 'i': 'l', '|': 'l', '!': 'l', '3': 'e', '4': 'a',
+    '5': 's', '$': 's', '7': 't', '8': 'b', '@': 'a',
+})
+
+
+def normalize(sender_id):
+    """Fold case, homoglyphs and separators so look-alikes compare equal"""
+    folded = sender_id.casefold().replace('rn', 'm').replace('vv', 'w')
+    return re.sub(r'[\s\-_.]', '', folded.translate(_HOMOGLYPHS))
+
+
+def _max_distance(official):
+    return 1 if len(official) <= 5 else 2
+
+
+def _deletions(word, depth):
+    """All strings obtained by deleting up to `depth` characters from word"""
+    results = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+def _within_distance(a, b, limit):
+    """Levenshtein distance between a and b is <= limit (banded, early exit)"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+class SenderRegistry:
+    def __init__(self, json_path=SENDER_IDS_PATH, collection=None, reload_interval=SENDER_RELOAD_INTERVAL,
+                 shared=None):
+        self.json_path = json_path
+        self.collection = collection
+        self.reload_interval = reload_interval
+        self.shared = shared
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._source_version = None
+        self._checked_at = 0.0
+        self._apply([])
+        self.reload()
+
+    def attach_collection(self, collection):
+        """Use a MongoDB collection (documents with a `sender_id` field) as the source"""
+        self.collection = collection
+        self.reload()
+
+    def on_change(self, listener):
+        """Call listener() whenever the set of official IDs changes after the first load"""
+        self._listeners.append(listener)
+
+    def _read_source(self):
+        if self.collection is not None:
+            try:
+                ids = [doc['sender_id'] for doc in self.collection.find({}, {'sender_id': 1, '_id': 0})
+                       if doc.get('sender_id')]
+                self._publish(ids)
+                return ids, ('ids', tuple(sorted(ids)))
+            except Exception as e:
+                logger.warning("MongoDB sender registry load error: %s", e)
+        if self.shared is not None:
+            try:
+                snapshot = self.shared.get('sender_ids')
+                if snapshot is not None and snapshot[0]:
+                    return snapshot[0], ('ids', tuple(sorted(snapshot[0])))
+            except Exception as e:
+                logger.warning("Shared sender registry load error: %s", e)
+        try:
+            mtime = os.path.getmtime(self.json_path)
+            if self._source_version == ('json', mtime):
+                return None, self._source_version
+            with open(self.json_path, 'r', encoding='utf-8') as f:
+                ids = [entry.get('sender_id') for entry in json.load(f) if entry.get('sender_id')]
+            return ids, ('json', mtime)
+        except Exception as e:
+            logger.warning("Sender registry load error: %s", e)
+            return None, self._source_version
+
+    def _publish(self, ids):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set('sender_ids', ids, time.time() + SENDER_SNAPSHOT_TTL)
+        except Exception as e:
+            logger.warning("Shared sender registry write error: %s", e)
+
+    def reload(self, if_due=False):
+        """Re-read the source and rebuild the matchers if it changed"""
+        with self._lock:
+            # if_due (the request path): requests that queued behind a running reload must not repeat it
+            if if_due and time.monotonic() - self._checked_at <= self.reload_interval:
+                return
+            ids, version = self._read_source()
+            self._checked_at = time.monotonic()
+            if ids is None or version == self._source_version:
+                return
+            previous = self._state[0]
+            self._apply(ids)
+            self._source_version = version
+            changed = bool(previous) and previous != self._state[0]
+        if changed:
+            for listener in self._listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    logger.warning("Sender registry listener failed: %s", e)
+
+    def _apply(self, ids):
+        senders = frozenset(ids)
+        # Longest first so e.g. "SurePay" wins over a shorter ID it contains
+        alternation = '|'.join(re.escape(s) for s in sorted(senders, key=len, reverse=True))
+        pattern = re.compile(alternation) if alternation else None
+
+        # Fuzzy matching only makes sense for IDs with letters; numeric short
+        # codes one digit apart are usually unrelated services
+        lookalikes = {}
+        normalized = {}
+        for official in senders:
+            if not any(c.isalpha() for c in official):
+                continue
+            norm = normalize(official)
+            normalized[official] = norm
+            for variant in _deletions(norm, _max_distance(official)):
+                lookalikes.setdefault(variant, set()).add(official)
+
+        # Swap in the new state as a unit; readers never see a half-built registry
+        self._state = (senders, pattern, lookalikes, normalized)
+
+    def _current(self):
+        if time.monotonic() - self._checked_at > self.reload_interval:
+            self.reload(if_due=True)
+        return self._state
+
+    @property
+    def senders(self):
+        return self._current()[0]
+
+    def is_known(self, sender_id):
+        """EXACT, case-sensitive membership test"""
+        return bool(sender_id) and sender_id in self._current()[0]
+
+    def find_in(self, text):
+        """Return the first official sender ID contained in text, or None"""
+        pattern = self._current()[1]
+        if not text or pattern is None:
+            return None
+        match = pattern.search(text)
+        return match.group(0) if match else None
+
+    def lookalike_of(self, sender_id):
+        """Return the official ID that sender_id imitates, or None if it is known or unrelated"""
+        senders, _, lookalikes, normalized = self._current()
+        if not sender_id or sender_id in senders:
+            return None
+        candidate = normalize(sender_id)
+        if not candidate:
+            return None
+        depth = max((_max_distance(o) for o in normalized), default=0)
+        matches = set()
+        for variant in _deletions(candidate, depth):
+            matches |= lookalikes.get(variant, set())
+        for official in sorted(matches, key=len, reverse=True):
+            if _within_distance(candidate, normalized[official], _max_distance(official)):
+                return official
+        return None
+
+
+registry = SenderRegistry(shared=shared_cache.namespace('state'))
@@ -0,0 +1,321 @@
+"""
+Cache and state storage shared by every worker, and across hosts.
+
+SHARED_CACHE_URL picks the backend:
+
+- redis://host:6379/0 (or rediss://, unix://): a Redis-compatible server
+  shared by all instances behind the load balancer (`pip install redis`)
+- sqlite:///path/to/file.sqlite3: one WAL-mode file shared by the workers
+  of one host; the default, at db/shared_cache.sqlite3
+- memory://: this process only; a stand-in for tests and benchmarks
+
+Callers work in a Namespace ('vt', 'images', 'state', 'quota', 'jobs').
+Every namespace has a generation counter in the backend that is part of its
+keys, so invalidate() drops a whole namespace on every worker at once:
+workers read the generation at most every SHARED_CACHE_SYNC_INTERVAL
+seconds, clear their in-process near-caches when it moved, and the old
+entries simply expire.
+
+    python shared_cache.py invalidate images vt
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+
+SHARED_CACHE_URL = os.getenv(
+    "SHARED_CACHE_URL", 'sqlite:///' + os.path.join(BASE_DIR, 'db', 'shared_cache.sqlite3'))
+SHARED_CACHE_PREFIX = os.getenv("SHARED_CACHE_PREFIX", "helbme:")
+SHARED_CACHE_SYNC_INTERVAL = float(os.getenv("SHARED_CACHE_SYNC_INTERVAL", "5"))
+SHARED_CACHE_TIMEOUT = float(os.getenv("SHARED_CACHE_TIMEOUT", "0.5"))
+# Expired SQLite rows are purged after this many writes
+SQLITE_PURGE_EVERY = 1000
+
+
+class MemoryBackend:
+    """Process-local stand-in with the same semantics as the shared backends"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._entries = {}  # key -> (value, expires_at)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            found = [self._entries.get(key) for key in keys]
+        return [entry if entry is not None and entry[1] >= now else None for entry in found]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (json.loads(json.dumps(value)), expires_at)
+
+    def add(self, key, value, expires_at):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= time.time():
+                return False
+            self._entries[key] = (value, expires_at)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def count(self, key, expires_at):
+        with self._lock:
+            entry = self._entries.get(key)
+            value = entry[0] + 1 if entry is not None and entry[1] >= time.time() else 1
+            self._entries[key] = (value, expires_at)
+            return value
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+
+class SQLiteBackend:
+    """One file per host; every worker process opens its own connection"""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Never reuse a connection inherited across a fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=SHARED_CACHE_TIMEOUT * 10, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        now = time.time()
+        with self._lock:
+            rows = self._connection().execute(
+                f'SELECT key, value, expires_at FROM entries WHERE key IN ({",".join("?" * len(keys))})',
+                list(keys)).fetchall()
+        found = {key: (json.loads(value), expires_at) for key, value, expires_at in rows if expires_at >= now}
+        return [found.get(key) for key in keys]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)',
+                         (key, json.dumps(value), expires_at))
+            self._writes += 1
+            if self._writes % SQLITE_PURGE_EVERY == 0:
+                conn.execute('DELETE FROM entries WHERE expires_at < ?', (time.time(),))
+            conn.commit()
+
+    def add(self, key, value, expires_at):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM entries WHERE key = ? AND expires_at < ?', (key, time.time()))
+            cursor = conn.execute('INSERT OR IGNORE INTO entries (key, value, expires_at) VALUES (?, ?, ?)',
+                                  (key, json.dumps(value), expires_at))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            conn.commit()
+
+    def count(self, key, expires_at):
+        with self._lock:
+            conn = self._connection()
+            # The write lock is held from the upsert to the commit, so the read is atomic
+            conn.execute(
+                "INSERT INTO entries (key, value, expires_at) VALUES (?, '1', ?) ON CONFLICT(key) DO UPDATE SET "
+                "value = CASE WHEN expires_at < ? THEN '1' ELSE CAST(CAST(value AS INTEGER) + 1 AS TEXT) END, "
+                "expires_at = excluded.expires_at",
+                (key, expires_at, time.time()))
+            value = conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()[0]
+            conn.commit()
+            return int(value)
+
+    def incr(self, name):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                         'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+            conn.commit()
+            return conn.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()[0]
+
+    def counter(self, name):
+        with self._lock:
+            row = self._connection().execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+
+class RedisBackend:
+    """Any Redis-compatible server; values are stored as JSON [value, expires_at]"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _redis(self):
+        # redis-py pools are not fork-safe either
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                import redis  # optional: only needed when SHARED_CACHE_URL points at Redis
+                self._client = redis.Redis.from_url(self.url, socket_timeout=SHARED_CACHE_TIMEOUT,
+                                                    socket_connect_timeout=SHARED_CACHE_TIMEOUT)
+                self._pid = os.getpid()
+            return self._client
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        return [tuple(json.loads(raw)) if raw is not None else None for raw in self._redis().mget(keys)]
+
+    def set(self, key, value, expires_at):
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms > 0:
+            self._redis().set(key, json.dumps([value, expires_at]), px=ttl_ms)
+
+    def add(self, key, value, expires_at):
+        ttl_ms = max(1, int((expires_at - time.time()) * 1000))
+        return bool(self._redis().set(key, json.dumps([value, expires_at]), px=ttl_ms, nx=True))
+
+    def delete(self, key):
+        self._redis().delete(key)
+
+    def count(self, key, expires_at):
+        # A plain integer, unlike the JSON entries; only count() touches these keys
+        pipe = self._redis().pipeline()
+        pipe.incr(key)
+        pipe.pexpireat(key, int(expires_at * 1000))
+        return pipe.execute()[0]
+
+    def incr(self, name):
+        return self._redis().incr(name)
+
+    def counter(self, name):
+        return int(self._redis().get(name) or 0)
+
+
+def open_backend(url=SHARED_CACHE_URL):
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    raise ValueError(f"Unsupported SHARED_CACHE_URL: {url}")
+
+
+class Namespace:
+    """A generation-versioned slice of the shared backend"""
+
+    def __init__(self, backend, name, sync_interval=SHARED_CACHE_SYNC_INTERVAL):
+        self.backend = backend
+        self.name = name
+        self.sync_interval = sync_interval
+        self._generation_key = f'{SHARED_CACHE_PREFIX}{name}:generation'
+        self._generation = None
+        self._synced_at = 0.0
+
+    def sync(self):
+        """Re-read the generation (at most every sync_interval); True if it moved since the last read"""
+        now = time.monotonic()
+        if self._generation is not None and now - self._synced_at < self.sync_interval:
+            return False
+        self._synced_at = now
+        try:
+            generation = self.backend.counter(self._generation_key)
+        except Exception as e:
+            logger.warning("Shared cache unavailable (%s): %s", self.name, e)
+            return False
+        changed = self._generation is not None and generation != self._generation
+        self._generation = generation
+        return changed
+
+    def _key(self, key):
+        if self._generation is None:
+            self.sync()
+        return f'{SHARED_CACHE_PREFIX}{self.name}:{self._generation or 0}:{key}'
+
+    def get(self, key):
+        """Return (value, expires_at) or None when missing or expired"""
+        return self.backend.get_many([self._key(key)])[0]
+
+    def get_many(self, keys):
+        return self.backend.get_many([self._key(key) for key in keys])
+
+    def set(self, key, value, expires_at):
+        self.backend.set(self._key(key), value, expires_at)
+
+    def add(self, key, value, expires_at):
+        """Set key only if it is absent (or expired); True if this call set it"""
+        return self.backend.add(self._key(key), value, expires_at)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def count(self, key, expires_at):
+        """Atomically add one to a counter that lives until expires_at; returns the new value"""
+        return self.backend.count(self._key(key), expires_at)
+
+    def invalidate(self):
+        """Drop every entry of this namespace, on all workers"""
+        self._generation = self.backend.incr(self._generation_key)
+        self._synced_at = time.monotonic()
+        logger.info("Invalidated shared cache namespace %s (generation %s)", self.name, self._generation)
+
+
+backend = open_backend()
+_namespaces = {}
+
+
+def namespace(name):
+    if name not in _namespaces:
+        _namespaces[name] = Namespace(backend, name)
+    return _namespaces[name]
+
+
+def stats():
+    return {'backend': backend.name,
+            **{f'{name}_generation': ns._generation or 0 for name, ns in _namespaces.items()}}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'invalidate':
+        sys.exit("usage: python shared_cache.py invalidate NAMESPACE [NAMESPACE ...]")
+    for name in sys.argv[2:]:
+        namespace(name).invalidate()
+        print(f"{name}: generation {namespace(name)._generation}")
@@ -0,0 +1,111 @@
+"""
+Per-worker initialisation that must not block imports or run before a fork.
+
+With `gunicorn --preload` (see gunicorn.conf.py) the app and its heavy
+modules are imported once in the master and shared copy-on-write, and each
+worker calls init_worker() from the post_fork hook. Without gunicorn the
+first request calls it. It returns immediately: the OCR pool is warmed and
+MongoDB is connected (with backoff, forever, so a database that comes up
+later is picked up) on background threads, and readiness() reports when
+the worker can serve uploads.
+"""
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# gunicorn may call init_worker before the app (and its load_dotenv) is imported
+load_dotenv()
+
+import ocr_pool
+from retention import PERSIST_UPLOADS, upload_store
+from sender_registry import registry as sender_registry
+from url_reputation import reputation as url_reputation
+
+logger = logging.getLogger(__name__)
+
+# Empty MONGO_URI disables MongoDB; the registry then uses db/sender_ids.json
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB = os.getenv("MONGO_DB", "sms_scam_detection")
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "2000"))
+MONGO_RETRY_BASE = 5
+MONGO_RETRY_MAX = 300
+
+_lock = threading.Lock()
+_pid = None
+_state = {}
+
+
+def init_worker():
+    """Start this process's background initialisation once (again after a fork)"""
+    global _pid
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        _state.clear()
+        _state.update({'ocr': 'warming', 'mongo': 'connecting' if MONGO_URI else 'disabled',
+                       'started_at': time.time(), 'ready_at': None})
+        threading.Thread(target=_warm_ocr, name='ocr-warm-up', daemon=True).start()
+        if PERSIST_UPLOADS:
+            # Also expires copies left over from before a restart
+            upload_store.start()
+        if MONGO_URI:
+            threading.Thread(target=_connect_mongo, name='mongo-connect', daemon=True).start()
+
+
+def _warm_ocr():
+    # Imported here so importing startup stays cheap for gunicorn's config
+    from helpers import _configure_tesseract
+    try:
+        _configure_tesseract()
+        ocr_pool.warm_up()
+        _state['ocr'] = 'ready'
+    except Exception as e:
+        _state['ocr'] = 'failed'
+        logger.error("OCR warm-up failed: %s", e)
+
+
+def _connect_mongo():
+    from pymongo import MongoClient
+    delay = MONGO_RETRY_BASE
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+            client.admin.command('ping')
+            sender_registry.attach_collection(client[MONGO_DB]['sender_ids'])
+            url_reputation.attach_collection(client[MONGO_DB]['url_reputation'])
+            _state['mongo'] = 'connected'
+            logger.info("MongoDB connected after %s attempt(s)", attempts)
+            return
+        except Exception as e:
+            _state['mongo'] = 'unavailable'
+            # Only the first failure is worth a warning; Mongo is optional
+            log = logger.warning if attempts == 1 else logger.debug
+            log("MongoDB unavailable (%s); using bundled sender IDs, retrying in %ss", e, delay)
+        time.sleep(delay)
+        delay = min(delay * 2, MONGO_RETRY_MAX)
+
+
+def readiness():
+    """Return (ready, details): ready once OCR is warm and the sender registry is loaded"""
+    init_worker()
+    state = dict(_state)
+    registry_size = len(sender_registry.senders)
+    ready = state['ocr'] == 'ready' and registry_size > 0
+    if ready and state['ready_at'] is None:
+        _state['ready_at'] = state['ready_at'] = time.time()
+    return ready, {
+        'ready': ready,
+        'ocr': state['ocr'],
+        'ocr_pool': ocr_pool.engine(),
+        'sender_registry': registry_size,
+        'mongo': state['mongo'],
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.time() - state['started_at'], 1),
+    }
@@ -0,0 +1,10 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Keep tests away from the real shared cache, MongoDB and VirusTotal
+os.environ['SHARED_CACHE_URL'] = 'memory://'
+os.environ['MONGO_URI'] = ''
+os.environ['VT_API_KEY'] = ''
@@ -0,0 +1,64 @@
+import io
+import os
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import batch
+from batch import BatchTooLarge, collect_uploads
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCREENSHOT = os.path.join(BACKEND_DIR, 'uploads', '011_scam.jpg')
+
+
+def zip_storage(entries, name='batch.zip'):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename, data in entries:
+            archive.writestr(filename, data)
+    out.seek(0)
+    return FileStorage(out, filename=name)
+
+
+def screenshot():
+    with open(SCREENSHOT, 'rb') as f:
+        return f.read()
+
+
+def test_entries_are_read_lazily():
+    data = screenshot()
+    entries = collect_uploads([zip_storage([('a.jpg', data), ('notes.txt', b'x'), ('b.png', data)]),
+                               FileStorage(io.BytesIO(data), filename='c.jpg')])
+    assert [(entry.filename, entry.size) for entry in entries] == [
+        ('a.jpg', len(data)), ('b.png', len(data)), ('c.jpg', len(data))]
+    assert all(entry.read() == data for entry in entries)
+
+
+def test_zip_bomb_is_rejected_before_reading():
+    # 40 zero-filled "images" of 10 MB: a few hundred KB compressed
+    bomb = zip_storage([(f'{i}.jpg', bytes(batch.BATCH_MAX_IMAGE_BYTES)) for i in range(40)])
+    with pytest.raises(BatchTooLarge, match='compressed more than'):
+        collect_uploads([bomb])
+
+
+def test_total_uncompressed_budget(monkeypatch):
+    data = screenshot()
+    monkeypatch.setattr(batch, 'BATCH_MAX_TOTAL_BYTES', 2 * len(data) + 1)
+    assert len(collect_uploads([zip_storage([('a.jpg', data), ('b.jpg', data)])])) == 2
+    with pytest.raises(BatchTooLarge, match='MB of images'):
+        collect_uploads([zip_storage([('a.jpg', data), ('b.jpg', data), ('c.jpg', data)])])
+
+
+def test_oversized_entry_is_reported_not_read(monkeypatch):
+    data = screenshot()
+    monkeypatch.setattr(batch, 'BATCH_MAX_IMAGE_BYTES', len(data) - 1)
+    [entry] = collect_uploads([zip_storage([('big.jpg', data)])])
+    assert entry.size == 0 and entry.read() is None
+
+
+def test_image_count_limit(monkeypatch):
+    monkeypatch.setattr(batch, 'BATCH_MAX_IMAGES', 2)
+    data = screenshot()
+    with pytest.raises(BatchTooLarge, match='at most 2 images'):
+        collect_uploads([zip_storage([(f'{i}.jpg', data) for i in range(3)])])
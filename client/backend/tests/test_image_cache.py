@@ -0,0 +1,74 @@
+import io
+import os
+
+from PIL import Image, ImageDraw
+
+import shared_cache
+from image_cache import ImageResultCache, fingerprint
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCAM_SCREENSHOT = os.path.join(BACKEND_DIR, 'uploads', '011_scam.jpg')
+
+SCAM_RESULT = {'sender_id': '0110711830', 'is_known': False, 'verdict': 'Likely a Scam',
+               'urls_checked': [{'url': 'www.hef.co.ke', 'verdict': {'verdict': 'clean'}}]}
+
+
+def new_cache(backend=None):
+    return ImageResultCache(store=shared_cache.Namespace(backend or shared_cache.MemoryBackend(), 'images'))
+
+
+def with_sender(path, sender):
+    """The screenshot at path re-encoded with `sender` painted over its header"""
+    img = Image.open(path).convert('RGB')
+    width, height = img.size
+    draw = ImageDraw.Draw(img)
+    box = (int(width * 0.125), int(height * 0.03), int(width * 0.6), int(height * 0.07))
+    draw.rectangle(box, fill='white')
+    draw.text((box[0] + 4, box[1] + 4), sender, fill='black')
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+def test_exact_repeat_is_served():
+    cache = new_cache()
+    with open(SCAM_SCREENSHOT, 'rb') as f:
+        digest = fingerprint(f.read())
+    cache.put(digest, SCAM_RESULT)
+    assert cache.get(digest) == SCAM_RESULT
+    assert cache.stats()['exact_hits'] == 1
+
+
+def test_altered_sender_is_not_served_the_cached_result():
+    cache = new_cache()
+    with open(SCAM_SCREENSHOT, 'rb') as f:
+        cache.put(fingerprint(f.read()), SCAM_RESULT)
+    assert cache.get(fingerprint(with_sender(SCAM_SCREENSHOT, 'HELB'))) is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_shared_tier_and_invalidate():
+    backend = shared_cache.MemoryBackend()
+    first, second = new_cache(backend), new_cache(backend)
+    first.put('digest', SCAM_RESULT)
+    assert second.get('digest') == SCAM_RESULT
+    assert second.stats()['shared_hits'] == 1
+
+    first.invalidate()
+    assert new_cache(backend).get('digest') is None
+
+
+def test_results_with_failed_link_checks_are_not_cached(monkeypatch):
+    import app
+
+    cache = new_cache()
+    monkeypatch.setattr(app, 'image_cache', cache)
+    failed = dict(SCAM_RESULT, urls_checked=[
+        {'url': 'www.hef.co.ke', 'verdict': {'verdict': 'error', 'details': 'Missing API key'}}])
+    app.cache_result('a' * 64, failed)
+    assert cache.get('a' * 64) is None
+    no_links = dict(SCAM_RESULT, urls_checked=[{'message': 'No URLs found in the message'}])
+    app.cache_result('b' * 64, no_links)
+    assert cache.get('b' * 64) == no_links
+    app.cache_result('c' * 64, SCAM_RESULT)
+    assert cache.get('c' * 64) == SCAM_RESULT
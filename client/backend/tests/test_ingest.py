@@ -0,0 +1,33 @@
+import io
+
+import pytest
+from PIL import Image
+
+import ingest
+from ingest import UploadRejected, check_upload, decode_upload
+
+
+def encode(img, image_format):
+    out = io.BytesIO()
+    img.save(out, image_format)
+    return out.getvalue()
+
+
+def test_png_pixel_bomb_is_rejected_before_decoding():
+    # A few hundred KB on the wire, over 200 MB decoded
+    bomb = encode(Image.new('RGBA', (7500, 7500), 'white'), 'PNG')
+    assert len(bomb) < ingest.INGEST_MAX_BYTES
+    with pytest.raises(UploadRejected) as e:
+        check_upload(bomb, 'bomb.png')
+    assert e.value.status == 413
+
+
+def test_large_jpeg_is_decoded_within_max_side():
+    data = encode(Image.new('RGB', (6000, 8000), 'white'), 'JPEG')
+    assert check_upload(data, 'photo.jpg') == 'JPEG'
+    assert max(decode_upload(data).size) <= ingest.INGEST_MAX_SIDE
+
+
+def test_non_image_is_rejected():
+    with pytest.raises(UploadRejected):
+        check_upload(b'%PDF-1.4 not an image', 'scan.png')
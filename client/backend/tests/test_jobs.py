@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+import shared_cache
+from jobs import JobQueue, QueueFull
+
+
+def wait_for(queue, job_id, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job['status'] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} never reached {status}: {queue.get(job_id)}')
+
+
+def shared_queues(handler):
+    """Two queues standing in for two gunicorn workers on one shared backend"""
+    backend = shared_cache.MemoryBackend()
+    return [JobQueue(handler, store=shared_cache.Namespace(backend, 'jobs')) for _ in range(2)]
+
+
+def test_another_worker_sees_status_and_result():
+    release = threading.Event()
+
+    def handler(value):
+        release.wait(5)
+        return {'verdict': value}
+
+    accepting, other = shared_queues(handler)
+    job_id = accepting.submit('Likely a Scam')
+    assert wait_for(other, job_id, 'running')['result'] is None
+    release.set()
+    assert wait_for(other, job_id, 'done')['result'] == {'verdict': 'Likely a Scam'}
+
+
+def test_another_worker_sees_failures():
+    def handler():
+        raise ValueError('Image is truncated or corrupt')
+
+    accepting, other = shared_queues(handler)
+    job_id = accepting.submit()
+    assert wait_for(other, job_id, 'failed')['error'] == 'Image is truncated or corrupt'
+
+
+def test_rejected_job_is_not_published():
+    release = threading.Event()
+    backend = shared_cache.MemoryBackend()
+    queue = JobQueue(lambda: release.wait(5), workers=1, max_pending=1,
+                     store=shared_cache.Namespace(backend, 'jobs'))
+    try:
+        wait_for(queue, queue.submit(), 'running')
+        queue.submit()
+        with pytest.raises(QueueFull):
+            queue.submit()
+        published = [key for key in backend._entries if ':jobs:' in key]
+        assert len(published) == 2
+    finally:
+        release.set()
+
+
+def test_unknown_job():
+    accepting, other = shared_queues(lambda: None)
+    assert other.get('0' * 32) is None
+
+
+def test_store_failure_keeps_local_jobs():
+    class Broken:
+        def __getattr__(self, name):
+            raise ConnectionError('down')
+
+    queue = JobQueue(lambda: {'ok': True}, store=Broken())
+    assert wait_for(queue, queue.submit(), 'done')['result'] == {'ok': True}
+    assert queue.get('0' * 32) is None
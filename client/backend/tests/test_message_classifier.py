@@ -0,0 +1,21 @@
+import pytest
+
+from message_classifier import MESSAGE_SCAM_THRESHOLD, find_lures, score_message
+
+
+@pytest.mark.parametrize('text, lures', [
+    ("Send the processing fee of Ksh 500 urgently to 0712345678", ['fee', 'urgency', 'personal_number']),
+    ("Pay processing fee to 0712345678", ['fee', 'personal_number']),
+    ("UMESHINDA ZAWADI! BONYEZA *383#", ['prize', 'betting']),
+    ("Your HELB loan has been disbursed to your institution.", []),
+])
+def test_overlapping_lures_are_all_found(text, lures):
+    assert find_lures(text) == lures
+
+
+def test_scores_separate_scam_from_notice():
+    scam = score_message("Congratulations! To validate your HELB loan send KES 150 to Paybill 522533 by tonight.")
+    notice = score_message("Dear Mary, your HELB loan of Ksh 20,000 has been disbursed. Dial *642# for enquiries.")
+    assert scam.scam_score >= MESSAGE_SCAM_THRESHOLD
+    assert notice.scam_score < MESSAGE_SCAM_THRESHOLD
+    assert score_message('').scam_score == 0.0
@@ -0,0 +1,37 @@
+from sender_parser import parse_sender_candidates
+
+
+def best(text):
+    candidates = parse_sender_candidates(text)
+    return (candidates[0].sender_id, candidates[0].kind) if candidates else None
+
+
+def test_phone_split_across_a_space():
+    assert best("0110 711830\nText Message") == ('0110711830', 'phone')
+    assert best("< 0110-711830 :") == ('0110711830', 'phone')
+
+
+def test_standalone_short_code():
+    assert best("< 22141\nToday") == ('22141', 'shortcode')
+    # "0110" is the start of a phone number, not a short code
+    kinds = {c.sender_id: c.kind for c in parse_sender_candidates("0110 711830")}
+    assert kinds.get('0110') != 'shortcode'
+
+
+def test_underscored_sender_id():
+    assert best("TIFI_Slice\nHi. Need money?") == ('TIFI_Slice', 'alpha')
+
+
+def test_known_ids_split_by_ocr():
+    assert best("Sure Pay\n09:41") == ('SurePay', 'known')
+    assert best("H E L B") == ('HELB', 'known')
+    assert best("€ HELB :") == ('HELB', 'known')
+
+
+def test_known_id_outranks_earlier_lines():
+    assert best("12:41 4G\nHELB") == ('HELB', 'known')
+
+
+def test_empty_text():
+    assert parse_sender_candidates('') == []
+    assert parse_sender_candidates('\n  \n') == []
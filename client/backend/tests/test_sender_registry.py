@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+
+import pytest
+
+from sender_registry import SenderRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    path = tmp_path / 'sender_ids.json'
+    path.write_text(json.dumps([{'sender_id': 'HELB'}, {'sender_id': '5122'}, {'sender_id': 'SurePay'}]))
+    return SenderRegistry(json_path=str(path))
+
+
+@pytest.mark.parametrize('sender_id, official', [
+    ('HE1B', 'HELB'),
+    ('H3LB', 'HELB'),
+    ('helb', 'HELB'),
+    ('HELBB', 'HELB'),
+    ('Sure-Pay', 'SurePay'),
+    ('SUREPAY', 'SurePay'),
+])
+def test_lookalikes(registry, sender_id, official):
+    assert registry.lookalike_of(sender_id) == official
+
+
+@pytest.mark.parametrize('sender_id', ['HELB', 'SurePay', '5122', 'Safaricom', 'TIFI_Slice', '', None])
+def test_official_and_unrelated_ids_are_not_lookalikes(registry, sender_id):
+    assert registry.lookalike_of(sender_id) is None
+
+
+def test_is_known_is_exact(registry):
+    assert registry.is_known('HELB')
+    assert not registry.is_known('helb')
+    assert not registry.is_known('Sure Pay')
+
+
+def test_requests_queued_behind_a_reload_do_not_repeat_it(tmp_path):
+    class SlowCollection:
+        finds = 0
+
+        def find(self, *args):
+            SlowCollection.finds += 1
+            time.sleep(0.2)
+            return [{'sender_id': 'HELB'}]
+
+    path = tmp_path / 'sender_ids.json'
+    path.write_text(json.dumps([{'sender_id': 'HELB'}]))
+    registry = SenderRegistry(json_path=str(path), collection=SlowCollection(), reload_interval=0.1)
+    SlowCollection.finds = 0
+    time.sleep(0.15)
+    threads = [threading.Thread(target=registry.is_known, args=('HELB',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SlowCollection.finds == 1
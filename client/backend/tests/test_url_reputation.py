@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+
+import pytest
+
+from url_reputation import URLReputation, parse_url
+
+
+@pytest.fixture
+def reputation(tmp_path):
+    path = tmp_path / 'url_reputation.json'
+    path.write_text(json.dumps([
+        {'list': 'allow', 'domain': 'helb.co.ke'},
+        {'list': 'allow', 'domain': 'hef.co.ke'},
+        {'list': 'allow', 'domain': 'ecitizen.go.ke'},
+        {'list': 'shortener', 'domain': 'bit.ly'},
+        {'list': 'block', 'url': 'scam.example.com/helb'},
+    ]))
+    return URLReputation(json_path=str(path))
+
+
+def verdict(reputation, url):
+    result = reputation.check(parse_url(url))
+    return result['verdict'] if result else None
+
+
+@pytest.mark.parametrize('url', [
+    'http://he1b.co.ke.example.net/apply',
+    'he1b-portal.com',
+    'www.xn--hlb-bma.com',  # hélb.com
+    'https://helb.co.ke.verify-loans.top/',
+    'portal-ecltizen.com',
+    'helb2024.com',
+    'helb_loans.net',
+])
+def test_imitations_are_suspicious(reputation, url):
+    assert verdict(reputation, url) == 'suspicious'
+
+
+@pytest.mark.parametrize('url', [
+    'https://citizen.digital/news',
+    'help.safaricom.co.ke',
+    'held.io',
+    'https://hefty.com',
+    'https://shelby.com/x',
+    'https://michelbrown.com',
+    'helbportal.com',
+])
+def test_unrelated_domains_go_to_virustotal(reputation, url):
+    assert verdict(reputation, url) is None
+
+
+def test_near_miss_is_counted_but_not_settled(reputation):
+    assert verdict(reputation, 'ecitlzen.com') == 'suspicious'  # folds to "ecitizen"
+    assert verdict(reputation, 'ecitizn.com') is None
+    assert reputation.stats()['near_miss'] == 1
+
+
+def test_lists(reputation):
+    assert verdict(reputation, 'https://portal.helb.co.ke/login') == 'clean'
+    assert verdict(reputation, 'bit.ly/abc') == 'suspicious'
+    assert verdict(reputation, 'http://scam.example.com/helb') == 'malicious'
+
+
+@pytest.mark.parametrize('raw, url, host, key', [
+    ('www.hef.co.ke.', 'http://www.hef.co.ke/', 'hef.co.ke', 'hef.co.ke/'),
+    ('(HTTPS://Portal.HELB.co.ke:443/Apply?x=1)', 'https://portal.helb.co.ke/Apply?x=1',
+     'portal.helb.co.ke', 'portal.helb.co.ke/Apply?x=1'),
+    ('http://example.com:8080/a', 'http://example.com:8080/a', 'example.com', 'example.com:8080/a'),
+    ('https://hélb.com/login', 'https://xn--hlb-bma.com/login', 'xn--hlb-bma.com', 'xn--hlb-bma.com/login'),
+])
+def test_parse_url(raw, url, host, key):
+    assert parse_url(raw) == (url, host, key)
+
+
+@pytest.mark.parametrize('raw', ['', 'localhost', 'http://', 'example..com', 'http://[::1'])
+def test_parse_url_rejects_unusable_links(raw):
+    assert parse_url(raw) is None
+
+
+def test_requests_queued_behind_a_reload_do_not_repeat_it(tmp_path):
+    class SlowCollection:
+        finds = 0
+
+        def find(self, *args):
+            SlowCollection.finds += 1
+            time.sleep(0.2)
+            return [{'list': 'allow', 'domain': 'helb.co.ke'}]
+
+    path = tmp_path / 'url_reputation.json'
+    path.write_text('[]')
+    reputation = URLReputation(json_path=str(path), collection=SlowCollection(), reload_interval=0.1)
+    SlowCollection.finds = 0
+    time.sleep(0.15)
+    threads = [threading.Thread(target=reputation.check, args=(parse_url('helb.co.ke'),)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SlowCollection.finds == 1
@@ -0,0 +1,73 @@
+import pytest
+
+import shared_cache
+import virustotal
+from virustotal import SharedRateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(virustotal.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(virustotal.time, 'time', lambda: now[0])
+    return now
+
+
+def test_token_bucket_reserve(clock):
+    bucket = TokenBucket(4)  # one token every 15 s, burst of 4
+    assert [bucket.reserve() for _ in range(4)] == [0.0] * 4
+    assert bucket.reserve() == pytest.approx(15.0)
+    assert bucket.reserve() == pytest.approx(30.0)
+    # Too long a wait takes nothing
+    assert bucket.reserve(max_wait=10) is None
+    clock[0] += 45
+    assert bucket.reserve() == pytest.approx(0.0)
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(4)
+    for _ in range(4):
+        bucket.reserve()
+    clock[0] += 3600
+    assert [bucket.reserve() for _ in range(4)] == [0.0] * 4
+    assert bucket.reserve() > 0
+
+
+def test_shared_limiter_counts_across_processes(clock):
+    backend = shared_cache.MemoryBackend()
+    workers = [SharedRateLimiter(2, shared_cache.Namespace(backend, 'quota')) for _ in range(3)]
+    granted = [limiter.reserve(max_wait=0) for limiter in workers for _ in range(2)]
+    assert granted.count(0.0) == 2
+    assert granted.count(None) == 4
+    # The next free slot is in the following minute
+    assert workers[0].reserve() == pytest.approx(20.0)
+
+
+def test_shared_limiter_falls_back_when_store_fails(clock):
+    class Broken:
+        def count(self, key, expires_at):
+            raise ConnectionError('down')
+
+    limiter = SharedRateLimiter(1, Broken())
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve(max_wait=0) is None
+
+
+def test_request_path_waits_stay_under_the_worker_timeout():
+    # gunicorn's default worker timeout; a request waiting longer is killed mid-response
+    assert virustotal.VT_SHARED_WAIT < 30
+
+
+def test_lookup_held_by_another_worker_gives_up_with_a_retry_verdict(monkeypatch):
+    monkeypatch.setattr(virustotal, 'VT_API_KEY', 'key')
+    monkeypatch.setattr(virustotal, 'VT_SHARED_WAIT', 0.2)
+    monkeypatch.setattr(virustotal, 'VT_SHARED_POLL', 0.05)
+    monkeypatch.setattr(virustotal.verdict_cache, 'get', lambda url_id: None)
+    monkeypatch.setattr(virustotal.verdict_cache, 'claim', lambda url_id: (False, None))
+
+    def fetch(url_id):
+        raise AssertionError('looked up twice')
+
+    monkeypatch.setattr(virustotal, '_fetch_virustotal_verdict', fetch)
+    verdict = virustotal.verify_link_with_virustotal('http://example.com/')
+    assert verdict['verdict'] == 'error' and 'try again' in verdict['details']
@@ -0,0 +1,429 @@
+"""
+Local URL reputation, checked before VirusTotal.
+
+Extracted URLs are normalised (OCR debris such as trailing punctuation is
+stripped, hosts are lower-cased and IDNA-encoded, default ports dropped) and
+resolved against:
+
+- an allowlist of official domains (suffix trie: "portal.helb.co.ke" is
+  covered by "helb.co.ke")  -> clean
+- a blocklist of scam URLs and domains (Bloom filter)  -> malicious
+- URL shortener domains (suffix trie)  -> suspicious
+- look-alike domains whose registrable label is an official brand behind
+  homoglyphs, or has it as one of its words ("he1b.com", "he1b-portal.com",
+  "helb2024.com", but not "shelby.com"), or that carry a whole official
+  domain in front of another one ("helb.co.ke.example.net")  -> suspicious
+
+Only URLs none of these resolve are sent to VirusTotal, so official links
+and known scams cost no quota. Near misses (one edit away from a brand of
+LOOKALIKE_MIN_EDIT_BRAND letters or more, e.g. "ecitizn.com") are counted
+but still go to VirusTotal: too many real domains ("citizen.digital") are
+one edit away from a brand to settle them locally. The lists come from the
+bundled db/url_reputation.json plus, once MongoDB is connected, the
+`url_reputation` collection; both hold documents like {"list": "allow",
+"domain": "helb.co.ke"} or {"list": "block", "url": "example.com/login"}
+and are reloaded when they change; listeners added with on_change() then
+run.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from sender_registry import normalize as fold_lookalike
+from virustotal import verify_links_async, verify_links_with_virustotal
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+URL_REPUTATION_PATH = os.path.join(BASE_DIR, 'db', 'url_reputation.json')
+URL_REPUTATION_RELOAD_INTERVAL = float(os.getenv("URL_REPUTATION_RELOAD_INTERVAL", "60"))
+URL_BLOCKLIST_FP_RATE = float(os.getenv("URL_BLOCKLIST_FP_RATE", "1e-6"))
+
+# Shorter brand labels ("hef") match too many unrelated domains
+LOOKALIKE_MIN_BRAND = 4
+# Brands shorter than this are only matched exactly; "helb" is one edit from "held" and "help"
+LOOKALIKE_MIN_EDIT_BRAND = 5
+
+# Multi-label public suffixes; the registrable domain is one label longer
+_PUBLIC_SUFFIXES = frozenset({
+    'co.ke', 'go.ke', 'ac.ke', 'or.ke', 'ne.ke', 'sc.ke', 'me.ke', 'info.ke', 'mobi.ke',
+    'co.uk', 'org.uk', 'co.za', 'co.tz', 'co.ug', 'com.ng',
+})
+
+_LEADING = '(<[{\'"'
+_TRAILING = '.,;:!?)]}>\'"'
+_SCHEME = re.compile(r'^[a-z][a-z0-9+.\-]*://', re.IGNORECASE)
+_WORD_SEPARATOR = re.compile(r'[-_]+')
+# Digits left after folding are real digits, so they end a word ("helb2024")
+_WORD = re.compile(r'[0-9]+|[^0-9]+')
+
+ParsedURL = namedtuple('ParsedURL', ['url', 'host', 'key'])
+
+LISTS = ('allow', 'block', 'shortener')
+
+
+def clean_url(raw):
+    """An extracted URL without the punctuation OCR and sentences leave around it"""
+    return raw.strip().lstrip(_LEADING).rstrip(_TRAILING)
+
+
+def parse_url(raw):
+    """
+    Normalise an extracted URL; returns ParsedURL(url, host, key) or None if
+    it has no usable host. `url` is what VirusTotal is asked about, `host`
+    has any "www." removed and `key` (host, port, path and query, without the
+    scheme) is what the blocklist holds.
+    """
+    url = clean_url(raw)
+    if not _SCHEME.match(url):
+        url = 'http://' + url
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+        port = parts.port
+    except ValueError:
+        return None
+    if not host:
+        return None
+    try:
+        host = host.rstrip('.').encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+    if '.' not in host or '' in host.split('.'):
+        return None
+
+    port = '' if port in (None, 80, 443) else f':{port}'
+    rest = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    bare_host = host[4:] if host.startswith('www.') else host
+    return ParsedURL(f'{parts.scheme.lower()}://{host}{port}{rest}', bare_host, f'{bare_host}{port}{rest}')
+
+
+def normalize_url(raw):
+    """Canonical form of an extracted URL, or None if it is not a usable link"""
+    parsed = parse_url(raw)
+    return parsed.url if parsed else None
+
+
+def _suffix_length(labels):
+    return 2 if len(labels) > 2 and '.'.join(labels[-2:]) in _PUBLIC_SUFFIXES else 1
+
+
+def _fold_host(host):
+    """".helb.co.ke." for "he1b.co.ke": each label folded, dots kept"""
+    return '.' + '.'.join(fold_lookalike(label) for label in host.split('.')) + '.'
+
+
+def _label_words(label):
+    """Folded words of a domain label and the whole label folded: "he1b-portal" -> helb, portal, helbportal"""
+    words = {fold_lookalike(label)}
+    for part in _WORD_SEPARATOR.split(label):
+        folded = fold_lookalike(part)
+        words.add(folded)
+        words.update(_WORD.findall(folded))
+    return words
+
+
+def _one_edit_apart(a, b):
+    """True if a and b differ by at most one insertion, deletion or substitution"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+class DomainTrie:
+    """Suffix trie over domain labels; a listed domain also covers its subdomains"""
+
+    _END = ''  # labels are never empty, so this key marks a listed domain
+
+    def __init__(self, domains=()):
+        self._root = {}
+        self.size = 0
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        node = self._root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        if self._END not in node:
+            self.size += 1
+        node[self._END] = domain
+
+    def match(self, host):
+        """Return the listed domain that host equals or is a subdomain of, or None"""
+        node = self._root
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+            if self._END in node:
+                return node[self._END]
+        return None
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter; no false negatives, false positives at about fp_rate"""
+
+    def __init__(self, capacity, fp_rate=URL_BLOCKLIST_FP_RATE):
+        capacity = max(1, capacity)
+        self.bits = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        self.size = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.size += 1
+
+    def __contains__(self, item):
+        array = self._array
+        return all(array[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+
+class URLReputation:
+    def __init__(self, json_path=URL_REPUTATION_PATH, collection=None,
+                 reload_interval=URL_REPUTATION_RELOAD_INTERVAL):
+        self.json_path = json_path
+        self.collection = collection
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._source_version = None
+        self._file = (None, [])
+        self._listeners = []
+        self._checked_at = 0.0
+        self._counters = {'allowlisted': 0, 'blocklisted': 0, 'shortener': 0, 'lookalike': 0,
+                          'near_miss': 0, 'invalid': 0, 'unresolved': 0}
+        self._apply([])
+        self.reload()
+
+    def attach_collection(self, collection):
+        """Add a MongoDB collection of list entries to the bundled JSON"""
+        self.collection = collection
+        self.reload()
+
+    def on_change(self, listener):
+        """Call listener() whenever the lists change after the first load"""
+        self._listeners.append(listener)
+
+    def _read_source(self):
+        try:
+            mtime = os.path.getmtime(self.json_path)
+            if mtime != self._file[0]:
+                with open(self.json_path, 'r', encoding='utf-8') as f:
+                    self._file = (mtime, json.load(f))
+        except Exception as e:
+            logger.warning("URL reputation list load error: %s", e)
+        entries = list(self._file[1])
+        mongo = ()
+        if self.collection is not None:
+            try:
+                mongo = tuple(sorted(
+                    (doc.get('list', ''), doc.get('domain') or '', doc.get('url') or '')
+                    for doc in self.collection.find({}, {'list': 1, 'domain': 1, 'url': 1, '_id': 0})))
+                entries.extend({'list': l, 'domain': d, 'url': u} for l, d, u in mongo)
+            except Exception as e:
+                logger.warning("MongoDB URL reputation load error: %s", e)
+        return entries, (self._file[0], mongo)
+
+    def reload(self, if_due=False):
+        """Re-read the sources and rebuild the lookup structures if they changed"""
+        with self._lock:
+            # if_due (the request path): requests that queued behind a running reload must not repeat it
+            if if_due and time.monotonic() - self._checked_at <= self.reload_interval:
+                return
+            entries, version = self._read_source()
+            self._checked_at = time.monotonic()
+            if version == self._source_version:
+                return
+            changed = self._source_version is not None
+            self._apply(entries)
+            self._source_version = version
+        if changed:
+            for listener in self._listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    logger.warning("URL reputation listener failed: %s", e)
+
+    def _apply(self, entries):
+        domains = {name: [] for name in LISTS}
+        blocked = []
+        for entry in entries:
+            kind = entry.get('list')
+            if kind not in domains:
+                continue
+            target = entry.get('domain') or entry.get('url')
+            parsed = parse_url(target) if target else None
+            if parsed is None:
+                logger.warning("Ignoring invalid URL reputation entry: %s", entry)
+                continue
+            if kind == 'block':
+                blocked.append(parsed.host if entry.get('domain') else parsed.key)
+            else:
+                domains[kind].append(parsed.host)
+
+        blocklist = BloomFilter(len(blocked))
+        for item in blocked:
+            blocklist.add(item)
+
+        # Brands are the registrable labels of official domains ("helb" for helb.co.ke)
+        brands = {}
+        for domain in domains['allow']:
+            labels = domain.split('.')
+            if len(labels) > _suffix_length(labels):
+                brand = fold_lookalike(labels[-_suffix_length(labels) - 1])
+                if len(brand) >= LOOKALIKE_MIN_BRAND:
+                    brands.setdefault(brand, domain)
+
+        # Swapped in as a unit, like the sender registry
+        self._state = (DomainTrie(domains['allow']), blocklist, DomainTrie(domains['shortener']), brands,
+                       tuple((domain, _fold_host(domain)) for domain in domains['allow']))
+
+    def _current(self):
+        if time.monotonic() - self._checked_at > self.reload_interval:
+            self.reload(if_due=True)
+        return self._state
+
+    def _registrable_label(self, host):
+        """The label in front of the public suffix ("he1b" for portal.he1b.co.ke), IDN folded to ASCII"""
+        labels = host.split('.')
+        label = labels[-_suffix_length(labels) - 1] if len(labels) > _suffix_length(labels) else ''
+        if label.startswith('xn--'):
+            # Internationalised labels: "hélb" -> "helb"
+            try:
+                label = unicodedata.normalize('NFKD', label.encode('ascii').decode('idna'))
+                label = label.encode('ascii', 'ignore').decode('ascii')
+            except UnicodeError:
+                pass
+        return label
+
+    def _lookalike_of(self, host, brands, officials):
+        """Official domain the host imitates, or None"""
+        dotted = _fold_host(host)
+        for official, folded in officials:
+            # Allowlisted hosts never get here, so this is "he1b.co.ke.example.net"
+            if folded in dotted:
+                return official
+        # Whole words only: "shelby" and "michelbrown" merely contain "helb"
+        words = _label_words(self._registrable_label(host))
+        for brand, official in brands.items():
+            if brand in words:
+                return official
+        return None
+
+    def _near_miss_of(self, host, brands):
+        """Official domain whose brand is one edit from the host's registrable label, or None"""
+        label = fold_lookalike(self._registrable_label(host))
+        for brand, official in brands.items():
+            if len(brand) >= LOOKALIKE_MIN_EDIT_BRAND and _one_edit_apart(label, brand):
+                return official
+        return None
+
+    def _blocklisted(self, parsed, blocklist):
+        if not blocklist.size:
+            return False
+        if parsed.key in blocklist:
+            return True
+        labels = parsed.host.split('.')
+        # The host and each parent domain down to the registrable one
+        for start in range(len(labels) - _suffix_length(labels)):
+            if '.'.join(labels[start:]) in blocklist:
+                return True
+        return False
+
+    def check(self, parsed):
+        """Local verdict for a ParsedURL, or None if only VirusTotal can tell"""
+        allowlist, blocklist, shorteners, brands, officials = self._current()
+        if self._blocklisted(parsed, blocklist):
+            self._counters['blocklisted'] += 1
+            return {"verdict": "malicious", "details": "Listed in the local blocklist of scam links"}
+        official = allowlist.match(parsed.host)
+        if official:
+            self._counters['allowlisted'] += 1
+            return {"verdict": "clean", "details": f"Official domain ({official})"}
+        shortener = shorteners.match(parsed.host)
+        if shortener:
+            self._counters['shortener'] += 1
+            return {"verdict": "suspicious",
+                    "details": f"Shortened link ({shortener}) hides its real destination"}
+        official = self._lookalike_of(parsed.host, brands, officials)
+        if official:
+            self._counters['lookalike'] += 1
+            return {"verdict": "suspicious", "details": f"Domain imitates the official {official}"}
+        if self._near_miss_of(parsed.host, brands):
+            self._counters['near_miss'] += 1
+        self._counters['unresolved'] += 1
+        return None
+
+    def resolve(self, urls):
+        """
+        Split urls into ({url: local verdict}, {url: normalised url for VirusTotal});
+        each distinct URL appears in exactly one of the two.
+        """
+        verdicts = {}
+        pending = {}
+        for url in dict.fromkeys(urls):
+            parsed = parse_url(url)
+            if parsed is None:
+                self._counters['invalid'] += 1
+                verdicts[url] = {"verdict": "error", "details": "Not a valid link"}
+                continue
+            verdict = self.check(parsed)
+            if verdict is None:
+                pending[url] = parsed.url
+            else:
+                verdicts[url] = verdict
+        return verdicts, pending
+
+    def stats(self):
+        allowlist, blocklist, shorteners, brands, officials = self._state
+        return {**self._counters, 'allowlist_size': allowlist.size, 'blocklist_size': blocklist.size,
+                'shortener_size': shorteners.size, 'brands': sorted(set(brands.values()))}
+
+
+reputation = URLReputation()
+
+
+def check_links(urls, lookup=verify_links_with_virustotal):
+    """Verdicts for urls, in order: local reputation first, VirusTotal for the rest"""
+    if not urls:
+        return []
+    verdicts, pending = reputation.resolve(urls)
+    if pending:
+        verdicts.update(zip(pending, lookup(list(pending.values()))))
+    return [dict(verdicts[url]) for url in urls]
+
+
+async def check_links_async(urls):
+    """check_links for an event loop"""
+    if not urls:
+        return []
+    # resolve() may reload the lists, which reads the file and queries MongoDB
+    verdicts, pending = await asyncio.to_thread(reputation.resolve, urls)
+    if pending:
+        verdicts.update(zip(pending, await verify_links_async(list(pending.values()))))
+    return [dict(verdicts[url]) for url in urls]
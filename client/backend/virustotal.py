@@ -0,0 +1,364 @@
+"""
+VirusTotal URL lookups.
+
+All lookups share one pooled keep-alive HTTP session. The VirusTotal
+per-minute quota belongs to the API key, so every worker and host counts
+its calls in the same one-minute windows of the shared cache; lookups that
+exceed the quota wait for a later window instead of failing. If the shared
+cache is unreachable each process falls back to its own token bucket.
+Concurrent lookups of the same URL are coalesced into one API call, within
+a process and (through the shared cache's claim) across workers and hosts,
+and the URLs of a message are checked in parallel. verify_links_async does
+the same on an event loop with httpx; its verdict cache calls (SQLite or
+Redis) run on the default thread pool.
+
+All of this waiting happens inside the upload request, so the longest wait
+(VT_SHARED_WAIT: the quota wait plus the HTTP timeouts) stays below
+gunicorn's default 30 s worker timeout. A link that would wait longer gets
+an error verdict asking to try again, which the verdict cache keeps only
+briefly.
+"""
+import asyncio
+import base64
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+import shared_cache
+from vt_cache import verdict_cache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+VT_API_KEY = os.getenv("VT_API_KEY")
+
+VT_API_URL = "https://www.virustotal.com/api/v3/urls/{}"
+VT_REQUESTS_PER_MINUTE = float(os.getenv("VT_REQUESTS_PER_MINUTE", "4"))  # public API quota
+VT_MAX_CONCURRENCY = int(os.getenv("VT_MAX_CONCURRENCY", "8"))
+# Longest wait for a quota slot; with VT_TIMEOUT it bounds how long a link holds up a request
+VT_MAX_QUEUE_WAIT = float(os.getenv("VT_MAX_QUEUE_WAIT", "10"))
+VT_TIMEOUT = (3.05, float(os.getenv("VT_READ_TIMEOUT", "10")))  # (connect, read) seconds
+# Polling interval while another worker looks up the same URL; it may wait for the quota too
+VT_SHARED_POLL = 0.25
+VT_SHARED_WAIT = VT_MAX_QUEUE_WAIT + VT_TIMEOUT[0] + VT_TIMEOUT[1]
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of rejecting callers"""
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """
+        Take one token and return how many seconds the caller must wait before
+        using it, or None (taking nothing) if that wait would exceed max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def acquire(self, max_wait=None):
+        """Block until a token is available; returns False if it would take longer than max_wait"""
+        wait = self.reserve(max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class SharedRateLimiter:
+    """
+    Fixed one-minute windows counted in the shared cache, so the quota holds
+    across all workers. Same reserve()/acquire() interface as TokenBucket.
+    """
+
+    WINDOW = 60
+
+    def __init__(self, rate_per_minute, store, fallback=None):
+        self.limit = max(1, int(rate_per_minute))
+        self.store = store
+        self.fallback = fallback or TokenBucket(rate_per_minute)
+
+    def reserve(self, max_wait=None):
+        """
+        Take a slot in the first window that has one and return the seconds to
+        wait until it starts, or None (taking nothing) if that exceeds max_wait.
+        """
+        now = time.time()
+        window = int(now // self.WINDOW)
+        try:
+            while True:
+                wait = max(0.0, window * self.WINDOW - now)
+                if max_wait is not None and wait > max_wait:
+                    return None
+                # Kept one window past its end so late readers still see it
+                if self.store.count(f'window:{window}', (window + 2) * self.WINDOW) <= self.limit:
+                    return wait
+                window += 1
+        except Exception as e:
+            logger.warning("Shared VirusTotal quota unavailable (%s); limiting this process only", e)
+            return self.fallback.reserve(max_wait)
+
+    def acquire(self, max_wait=None):
+        """Block until a slot is available; returns False if it would take longer than max_wait"""
+        wait = self.reserve(max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+rate_limiter = SharedRateLimiter(VT_REQUESTS_PER_MINUTE, shared_cache.namespace('quota'))
+
+_state = {'pid': None, 'session': None, 'executor': None}
+_state_lock = threading.Lock()
+_inflight = {}  # url_id -> Future shared by concurrent lookups of the same URL
+_inflight_lock = threading.Lock()
+
+
+def _process_state():
+    # Sessions and thread pools must not be shared across a fork
+    with _state_lock:
+        if _state['pid'] != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=VT_MAX_CONCURRENCY)
+            session.mount('https://', adapter)
+            _state.update(
+                pid=os.getpid(),
+                session=session,
+                executor=ThreadPoolExecutor(max_workers=VT_MAX_CONCURRENCY, thread_name_prefix='virustotal'),
+            )
+            _inflight.clear()
+        return _state
+
+
+def url_to_id(url):
+    """VirusTotal v3 identifier for a URL"""
+    return base64.urlsafe_b64encode(url.encode()).decode().strip("=")
+
+
+def verify_link_with_virustotal(url):
+    """Check a URL against the VirusTotal API"""
+    if not VT_API_KEY:
+        return {"verdict": "error", "details": "Missing API key"}
+
+    url_id = url_to_id(url)
+    cached = verdict_cache.get(url_id)
+    if cached is not None:
+        return cached
+
+    # Join an identical lookup that is already running
+    with _inflight_lock:
+        future = _inflight.get(url_id)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[url_id] = future
+    if not owner:
+        return dict(future.result())
+
+    try:
+        verdict = _wait_for_other_worker(url_id)
+        if verdict is None:
+            try:
+                verdict = _fetch_virustotal_verdict(url_id)
+                verdict_cache.put(url_id, verdict)
+            finally:
+                verdict_cache.release(url_id)
+        future.set_result(verdict)
+    except BaseException as e:
+        future.set_result({"verdict": "error", "details": str(e)})
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(url_id, None)
+    return verdict
+
+
+def _still_running():
+    return {"verdict": "error", "details": "VirusTotal lookup still running, try again shortly"}
+
+
+def _wait_for_other_worker(url_id):
+    """
+    None once this process holds the lookup claim, or the verdict another
+    worker cached meanwhile, or an error verdict if that takes over VT_SHARED_WAIT.
+    """
+    deadline = time.monotonic() + VT_SHARED_WAIT
+    while True:
+        claimed, verdict = verdict_cache.claim(url_id)
+        if claimed or verdict is not None:
+            return verdict
+        if time.monotonic() > deadline:
+            # Looking it up here as well would double the time this request waits
+            return _still_running()
+        time.sleep(VT_SHARED_POLL)
+
+
+def verify_links_with_virustotal(urls):
+    """Check several URLs in parallel; returns verdicts in the order of `urls`"""
+    if not urls:
+        return []
+    unique = list(dict.fromkeys(urls))
+    if len(unique) == 1:
+        verdicts = {unique[0]: verify_link_with_virustotal(unique[0])}
+    else:
+        executor = _process_state()['executor']
+        futures = {url: executor.submit(verify_link_with_virustotal, url) for url in unique}
+        verdicts = {url: future.result() for url, future in futures.items()}
+    return [dict(verdicts[url]) for url in urls]
+
+
+def _fetch_virustotal_verdict(url_id):
+    """Query VirusTotal for a url_id and summarise its last analysis"""
+    if not rate_limiter.acquire(VT_MAX_QUEUE_WAIT):
+        return {"verdict": "error", "details": "VirusTotal quota exhausted, try again shortly"}
+
+    try:
+        headers = {"x-apikey": VT_API_KEY}
+        session = _process_state()['session']
+
+        response = session.get(VT_API_URL.format(url_id), headers=headers, timeout=VT_TIMEOUT)
+        return _verdict_from_response(response)
+
+    except Exception as e:
+        return {"verdict": "error", "details": str(e)}
+
+
+def _verdict_from_response(response):
+    """Summarise a VirusTotal URL report (a requests or httpx response)"""
+    if response.status_code == 200:
+        result = response.json()
+        stats = result.get("data", {}).get("attributes", {}).get("last_analysis_stats", {})
+        malicious = stats.get("malicious", 0)
+        suspicious = stats.get("suspicious", 0)
+
+        if malicious > 0:
+            return {"verdict": "malicious", "details": f"Flagged by {malicious} security vendors"}
+        elif suspicious > 0:
+            return {"verdict": "suspicious", "details": f"Flagged as suspicious by {suspicious} security vendors"}
+        else:
+            return {"verdict": "clean", "details": "No security vendors flagged this URL"}
+    elif response.status_code == 429:
+        return {"verdict": "error", "details": "VirusTotal rate limit reached"}
+    else:
+        return {"verdict": "error", "details": "API request failed"}
+
+
+# ---------------------------
+# ASYNC LOOKUPS (asgi.py)
+# ---------------------------
+_async_state = {'loop': None, 'client': None, 'inflight': {}}
+
+
+def _async_client():
+    """httpx.AsyncClient and in-flight table of the running event loop"""
+    import httpx  # optional: only the ASGI entry point needs it
+
+    loop = asyncio.get_running_loop()
+    if _async_state['loop'] is not loop:
+        _async_state.update(
+            loop=loop,
+            client=httpx.AsyncClient(
+                timeout=httpx.Timeout(VT_TIMEOUT[1], connect=VT_TIMEOUT[0]),
+                limits=httpx.Limits(max_connections=VT_MAX_CONCURRENCY, max_keepalive_connections=VT_MAX_CONCURRENCY),
+            ),
+            inflight={},
+        )
+    return _async_state['client'], _async_state['inflight']
+
+
+async def close_async_client():
+    client = _async_state['client']
+    _async_state.update(loop=None, client=None, inflight={})
+    if client is not None:
+        await client.aclose()
+
+
+async def verify_link_async(url):
+    """verify_link_with_virustotal for an event loop: same cache, quota and coalescing"""
+    if not VT_API_KEY:
+        return {"verdict": "error", "details": "Missing API key"}
+
+    url_id = url_to_id(url)
+    cached = await asyncio.to_thread(verdict_cache.get, url_id)
+    if cached is not None:
+        return cached
+
+    client, inflight = _async_client()
+    future = inflight.get(url_id)
+    if future is not None:
+        return dict(await asyncio.shield(future))
+
+    future = asyncio.get_running_loop().create_future()
+    inflight[url_id] = future
+    try:
+        verdict = await _wait_for_other_worker_async(url_id)
+        if verdict is None:
+            try:
+                verdict = await _fetch_verdict_async(client, url_id)
+                await asyncio.to_thread(verdict_cache.put, url_id, verdict)
+            finally:
+                await asyncio.to_thread(verdict_cache.release, url_id)
+        future.set_result(verdict)
+    except BaseException as e:
+        future.set_result({"verdict": "error", "details": str(e)})
+        raise
+    finally:
+        inflight.pop(url_id, None)
+    return verdict
+
+
+async def _wait_for_other_worker_async(url_id):
+    deadline = time.monotonic() + VT_SHARED_WAIT
+    while True:
+        claimed, verdict = await asyncio.to_thread(verdict_cache.claim, url_id)
+        if claimed or verdict is not None:
+            return verdict
+        if time.monotonic() > deadline:
+            return _still_running()
+        await asyncio.sleep(VT_SHARED_POLL)
+
+
+async def verify_links_async(urls):
+    """Check several URLs concurrently; returns verdicts in the order of `urls`"""
+    if not urls:
+        return []
+    unique = list(dict.fromkeys(urls))
+    results = await asyncio.gather(*(verify_link_async(url) for url in unique))
+    verdicts = dict(zip(unique, results))
+    return [dict(verdicts[url]) for url in urls]
+
+
+async def _fetch_verdict_async(client, url_id):
+    # Same shared quota as the threaded lookups, but neither the count nor the wait blocks the loop
+    wait = await asyncio.to_thread(rate_limiter.reserve, VT_MAX_QUEUE_WAIT)
+    if wait is None:
+        return {"verdict": "error", "details": "VirusTotal quota exhausted, try again shortly"}
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+    try:
+        response = await client.get(VT_API_URL.format(url_id), headers={"x-apikey": VT_API_KEY})
+        return _verdict_from_response(response)
+    except Exception as e:
+        return {"verdict": "error", "details": str(e)}
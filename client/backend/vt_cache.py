@@ -0,0 +1,155 @@
+"""
+Two-tier cache for VirusTotal URL verdicts.
+
+A bounded in-memory LRU (the near-cache) sits in front of the shared cache
+(shared_cache.py: Redis across hosts, or a SQLite file shared by the workers
+of one host), so verdicts survive restarts and a URL any worker has looked
+up is not looked up again by the others. Entries are keyed by the
+VirusTotal url_id and expire per verdict: malicious results are kept longest,
+clean ones shorter, and API errors are cached briefly with exponential
+backoff so a failing lookup is not retried on every upload. claim() lets
+only one worker at a time query VirusTotal for the same URL.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import shared_cache
+
+logger = logging.getLogger(__name__)
+
+VT_CACHE_SIZE = int(os.getenv("VT_CACHE_SIZE", "2048"))
+# How long one worker may hold the claim on a URL lookup before others take over
+VT_CLAIM_TTL = float(os.getenv("VT_CLAIM_TTL", "90"))
+
+# Seconds each verdict stays cached
+VERDICT_TTLS = {
+    'malicious': 7 * 86400,
+    'suspicious': 86400,
+    'clean': 6 * 3600,
+}
+ERROR_TTL_BASE = 60
+ERROR_TTL_MAX = 3600
+
+
+class VerdictCache:
+    def __init__(self, store=None, max_entries=VT_CACHE_SIZE):
+        self.store = store
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # url_id -> (verdict, expires_at)
+        self._error_counts = {}
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'errors_cached': 0}
+
+    def _sync(self):
+        # Another process invalidated the shared namespace: drop the near-cache too
+        if self.store is not None and self.store.sync():
+            with self._lock:
+                self._memory.clear()
+                self._error_counts.clear()
+
+    def get(self, url_id):
+        """Return a cached verdict dict or None on a miss"""
+        self._sync()
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(url_id)
+            if entry is not None:
+                if entry[1] >= now:
+                    self._memory.move_to_end(url_id)
+                    self._counters['memory_hits'] += 1
+                    return dict(entry[0])
+                del self._memory[url_id]
+
+        entry = None
+        if self.store is not None:
+            try:
+                entry = self.store.get(url_id)
+            except Exception as e:
+                logger.warning("VirusTotal cache read error: %s", e)
+
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['persistent_hits'] += 1
+            self._remember(url_id, entry[0], entry[1])
+            return dict(entry[0])
+
+    def put(self, url_id, verdict):
+        """Cache a verdict; 'error' verdicts back off exponentially on repeated failures"""
+        with self._lock:
+            if verdict.get('verdict') == 'error':
+                failures = self._error_counts.get(url_id, 0)
+                self._error_counts[url_id] = failures + 1
+                ttl = min(ERROR_TTL_BASE * 2 ** failures, ERROR_TTL_MAX)
+                self._counters['errors_cached'] += 1
+            else:
+                self._error_counts.pop(url_id, None)
+                ttl = VERDICT_TTLS.get(verdict.get('verdict'), ERROR_TTL_BASE)
+            expires_at = time.time() + ttl
+            self._remember(url_id, dict(verdict), expires_at)
+
+        # Errors stay in memory only so a restart retries them straight away
+        if self.store is not None and verdict.get('verdict') != 'error':
+            try:
+                self.store.set(url_id, verdict, expires_at)
+            except Exception as e:
+                logger.warning("VirusTotal cache write error: %s", e)
+
+    def claim(self, url_id):
+        """
+        Coordinate a VirusTotal lookup across workers. Returns (True, None)
+        when this process should query VirusTotal (and later release()),
+        (False, verdict) when another worker has meanwhile cached one, or
+        (False, None) while another worker's lookup is still running.
+        """
+        if self.store is None:
+            return True, None
+        try:
+            claimed = self.store.add(f'claim:{url_id}', os.getpid(), time.time() + VT_CLAIM_TTL)
+            # Also after winning: the previous holder may have stored its verdict and released
+            entry = self.store.get(url_id)
+            if claimed and entry is not None:
+                self.store.delete(f'claim:{url_id}')
+        except Exception as e:
+            logger.warning("VirusTotal cache claim error: %s", e)
+            return True, None
+        if entry is None:
+            return claimed, None
+        with self._lock:
+            self._remember(url_id, entry[0], entry[1])
+        return False, dict(entry[0])
+
+    def release(self, url_id):
+        if self.store is None:
+            return
+        try:
+            self.store.delete(f'claim:{url_id}')
+        except Exception as e:
+            logger.warning("VirusTotal cache release error: %s", e)
+
+    def _remember(self, url_id, verdict, expires_at):
+        self._memory[url_id] = (verdict, expires_at)
+        self._memory.move_to_end(url_id)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        # Keep the backoff table bounded along with the LRU
+        if len(self._error_counts) > self.max_entries:
+            self._error_counts.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['memory_hits'] + self._counters['persistent_hits'] + self._counters['misses']
+            hits = lookups - self._counters['misses']
+            return {
+                **self._counters,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+            }
+
+
+verdict_cache = VerdictCache(shared_cache.namespace('vt'))